@@ -3,7 +3,7 @@
 这里提供内部命令的导入，以及一些外部工具
 """
 from .command import pysh, exit, ps, history, ls, ps, cd, kill, hash, help, \
-    echo
+    echo, cache, head, jobs, fg, bg, wait, time, parallel
 from .manage.dispatch import dispatch
 from .manage.env import Application
 
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+from .fg import _find
+from ..manage.env import Application
+from ..manage.jobs import Jobs
+
+app = Application()
+
+
+@app.register
+class bg:
+    help = False
+    usage = """
+Usage:
+    bg [id]：让暂停的后台作业继续执行。id默认为最近的作业
+    bg --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if '--help' in self.args:
+            self.help = True
+
+    def handler(self):
+        if self.help:
+            print(self.usage)
+            return True
+
+        job = _find(self.args)
+        if job is None:
+            print('bg: 没有这个作业')
+            return False
+
+        if not Jobs.resume(job):
+            print('bg: 作业 {} 没有暂停'.format(job.id))
+            return False
+
+        print('[{}]  {} &'.format(job.id, job.command))
+        return True
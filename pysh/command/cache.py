@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from ..contrib.parser import ParseCache
+from ..manage.env import Application
+
+app = Application()
+
+
+@app.register
+class cache:
+    show = False
+    clear = False
+    new_maxsize = None
+    help = False
+    usage = """
+Usage:
+    cache -l：查看命令解析缓存的命中情况
+    cache -r：清空命令解析缓存
+    cache --maxsize num：修改最多缓存的命令数量
+    cache --help(default)：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if not self.args or '--help' in self.args:
+            self.help = True
+        elif '-l' in self.args:
+            self.show = True
+        elif '-r' in self.args:
+            self.clear = True
+        elif '--maxsize' in self.args:
+            maxsize_index = self.args.index('--maxsize')
+            try:
+                self.new_maxsize = int(self.args[maxsize_index + 1])
+            except (IndexError, ValueError) as e:
+                print(e)
+                self.help = True
+
+    def handler(self):
+        if self.help:
+            print(self.usage)
+        elif self.show:
+            for name, value in ParseCache.info().items():
+                print('{:<10}{}'.format(name, value))
+        elif self.clear:
+            length = len(ParseCache.storage)
+            ParseCache.clear()
+            print('已经清空 {} 条命令解析缓存'.format(length))
+        elif self.new_maxsize is not None:
+            ParseCache.new_maxsize(self.new_maxsize)
+
+        return True
@@ -20,7 +20,7 @@ Usage:
 
     def handler(self):
         if self.help:
-            print(self.usage)
+            yield self.usage
         else:
             for arg in self.args:
                 if arg.startswith("'"):
@@ -28,6 +28,6 @@ Usage:
                 elif arg.startswith('"'):
                     arg = arg.strip('"')
 
-                print(arg, sep=' ')
+                yield arg
 
         return True
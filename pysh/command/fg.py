@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from ..manage.env import Application
+from ..manage.jobs import Jobs
+
+app = Application()
+
+
+@app.register
+class fg:
+    help = False
+    usage = """
+Usage:
+    fg [id]：把后台作业切换到前台，等待它结束或暂停。id默认为最近的作业
+    fg --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if '--help' in self.args:
+            self.help = True
+
+    def handler(self):
+        if self.help:
+            print(self.usage)
+            return True
+
+        job = _find(self.args)
+        if job is None:
+            print('fg: 没有这个作业')
+            return False
+
+        print(job.command)
+        Jobs.resume(job)
+        return Jobs.wait([job.id], stop=True)
+
+
+def _find(args):
+    if args:
+        return Jobs.get(args[0])
+    elif Jobs.jobs:
+        return next(reversed(Jobs.jobs.values()))
+    return None
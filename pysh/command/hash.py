@@ -1,5 +1,5 @@
 # -*- coding: utf-8 -*-
-from ..manage.env import Application, EnvVariable
+from ..manage.env import Application, EnvVariable, PathIndex
 
 app = Application()
 
@@ -11,8 +11,8 @@ class hash:
     help = False
     usage = """
 Usage:
-    hash -l：查看缓存的路径
-    hash -r: 清空缓存的外部命令路径
+    hash -l：查看缓存的路径，以及PATH索引的统计
+    hash -r: 清空缓存的外部命令路径，下次查找时重新扫描PATH
     hash --help(default)：显示本帮助
             """
 
@@ -33,6 +33,7 @@ Usage:
         elif self.show:
             for name, path in EnvVariable.cached.items():
                 print(name + ' : ' + path)
+            print(' '.join('{}={}'.format(key, value) for key, value in PathIndex.info().items()))
         elif self.clear:
             length = len(EnvVariable.cached)
             if not EnvVariable.clear_cached():
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from ..manage.env import Application
+from ..manage.middleware import open_stream, encode
+
+app = Application()
+
+
+@app.register
+class head:
+    num = 10
+    help = False
+    usage = """
+Usage:
+    head [-n num] [path1] [path2] ...：输出文件或输入流的前num行，num默认为10
+    head --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = list(args or [])
+        if '--help' in self.args:
+            self.help = True
+        elif '-n' in self.args:
+            num_index = self.args.index('-n')
+            try:
+                self.num = int(self.args[num_index + 1])
+            except (IndexError, ValueError) as e:
+                print(e)
+                self.help = True
+            else:
+                del self.args[num_index:num_index + 2]
+
+        self.paths = [arg.strip('"').strip("'") for arg in self.args]
+
+    def handler(self):
+        """
+        读够num行就停止，管道上游以生成器方式输出时也随之停止
+        """
+        if self.help:
+            yield self.usage
+            return True
+
+        if not self.paths:
+            yield from self._head(sys.stdin)
+            return True
+
+        for path in self.paths:
+            try:
+                with open_stream(path, 'r') as file:
+                    if len(self.paths) > 1:
+                        yield '==> {} <=='.format(path)
+                    yield from self._head(file)
+            except (FileNotFoundError, IsADirectoryError, PermissionError) as e:
+                yield str(e)
+                return False
+
+        return True
+
+    def _head(self, file):
+        # 有字节流时按字节读取，二进制文件和没有结尾换行的最后一行都原样输出
+        file = getattr(file, 'buffer', file)
+        for index, line in enumerate(file):
+            if index >= self.num:
+                break
+            if isinstance(line, str) and not line.endswith('\n'):
+                # 没有结尾换行的最后一行作为原始数据输出，不补充换行
+                line = encode(line)
+            yield line
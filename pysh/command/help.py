@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from ..contrib.LineEdit import KeyMapping
+from ..contrib.control_flow import ControlFlow
 from ..contrib.keyword import Symbol, Keyword
 from ..manage.env import Application
 
@@ -80,6 +81,14 @@ Usage:
                     print('\tderc：', keywords[key].derc)
                 except AttributeError:
                     pass
+
+            print('\n注册的控制语句有：')
+            for name, control in ControlFlow.storage.items():
+                print(name, ':', control.keyword)
+                try:
+                    print('\tderc：', control.derc)
+                except AttributeError:
+                    pass
         elif self.le:
             mapping = KeyMapping._get_map_dict()
 
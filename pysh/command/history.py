@@ -46,25 +46,26 @@ Usage:
         History = self.env['History']
 
         if self.help:
-            print(self.usage)
+            yield self.usage
         elif self.maxlen:
             if self.new_maxlen is not None:
                 History.new_maxlen(self.new_maxlen)
             else:
-                print(History.maxlen())
+                yield str(History.maxlen())
         elif self.clear:
             if self.clear_num is not None:
                 for _ in range(self.clear_num):
                     History.history.pop()
             else:
-                History.history.clear()
+                History.clear()
         else:
             if self.num is not None:
                 length = len(History.history)
                 for index in range(length, length - self.num, -1):
-                    print(History.history[index-1])
+                    yield History.history[index-1]
             else:
-                for h in History.history:
-                    print(h)
+                # 复制一份，管道下游执行的命令也会追加历史记录
+                for h in list(History.history):
+                    yield h
 
         return True
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from ..manage.env import Application
+from ..manage.jobs import Jobs
+from ..manage.usage import format_seconds
+
+app = Application()
+
+
+@app.register
+class jobs:
+    long = False
+    help = False
+    usage = """
+Usage:
+    jobs：查看后台作业，已经结束的作业显示一次后不再保留
+    jobs -l：同时显示进程id、执行时间和CPU时间
+    jobs --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if '--help' in self.args:
+            self.help = True
+        elif '-l' in self.args:
+            self.long = True
+
+    def handler(self):
+        if self.help:
+            yield self.usage
+            return True
+
+        Jobs.reap()
+        for job in list(Jobs.jobs.values()):
+            if self.long:
+                user, sys_time = (job.usage.user, job.usage.sys) if job.usage else (None, None)
+                yield '[{}]  {:<8}{:<10}{:>8.2f}s{:>8}{:>8}  {}'.format(
+                    job.id, job.pid or '-', job.status(), job.wall_time,
+                    format_seconds(user), format_seconds(sys_time), job.command
+                )
+            else:
+                yield '[{}]  {:<10}{}'.format(job.id, job.status(), job.command)
+        Jobs.notify()
+
+        return True
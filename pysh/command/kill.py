@@ -35,6 +35,9 @@ Usage:
                     except AttributeError as e:
                         # 杀死当前阻塞的pysh进程时，会弹出AttributeError
                         print('你不能杀死阻塞中的pysh进程。请使用 exit 退出。')
+                    except RuntimeError as e:
+                        # 线程中执行的后台命令
+                        print(e)
                     else:
                         print('pid 为 {} 的进程 {} 已经被你终止.'.format(
                             str(id),
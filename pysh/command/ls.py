@@ -61,7 +61,7 @@ Optional:
 
     def handler(self):
         if self.help:
-            print(self.usage)
+            yield self.usage
             return
 
         for path in self.paths:
@@ -69,13 +69,13 @@ Optional:
             try:
                 dirs = os.listdir(path)
             except FileNotFoundError as e:
-                print(e)
+                yield str(e)
                 return False
             except NotADirectoryError as e:
-                print(e)
+                yield str(e)
                 return False
             except OSError as e:
-                print(e)
+                yield str(e)
                 return False
             else:
                 if self.ignore_back_backups:
@@ -88,7 +88,7 @@ Optional:
                     dirs.reverse()
 
                 if self.list:
-                    print('\n'.join(dirs))
+                    yield from dirs
                 else:
-                    print('  '.join(dirs))
+                    yield '  '.join(dirs)
         return True
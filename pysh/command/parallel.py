@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from ..contrib.tools import succeeded
+from ..manage.env import Application
+from ..manage.middleware import StdoutRedirection, StdinRedirection
+
+app = Application()
+
+
+@app.register
+class parallel:
+    jobs = os.cpu_count() or 1
+    tag = False
+    help = False
+    usage = """
+Usage:
+    parallel [-j num] [--tag] command [arg1] ... {} ...：对输入流的每一行执行一次命令，{}替换为这一行，
+                                                    没有{}时加在命令的最后
+    parallel [-j num] [--tag] command ... ::: word1 word2 ...：对:::后的每个单词执行一次命令
+    -j num：同时执行的命令数，默认为CPU数
+    --tag：在每行输出前加上产生它的参数
+    parallel --help：显示本帮助
+
+    每个命令的输出收集起来，按照参数的顺序输出，不会交错。
+            """
+
+    def __init__(self, *args):
+        self.args = list(args or [])
+        self.words = None
+
+        if not self.args or self.args[0] == '--help':
+            self.help = True
+            return
+
+        if ':::' in self.args:
+            index = self.args.index(':::')
+            self.args, self.words = self.args[:index], self.args[index + 1:]
+
+        # 选项只在命令之前
+        while self.args and self.args[0].startswith('-'):
+            option = self.args.pop(0)
+            if option == '--tag':
+                self.tag = True
+            elif option == '-j':
+                try:
+                    self.jobs = max(int(self.args.pop(0)), 1)
+                except (IndexError, ValueError) as e:
+                    print(e)
+                    self.help = True
+                    return
+            else:
+                self.args.insert(0, option)
+                break
+
+        if not self.args:
+            self.help = True
+
+    def handler(self):
+        if self.help:
+            yield self.usage
+            return True
+
+        words = self.words if self.words is not None else _read_lines(sys.stdin)
+        failed = 0
+        # 最多提前执行jobs * 2个命令，输入很多时不会占用过多内存
+        window = self.jobs * 2
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='pysh-parallel') \
+                as executor:
+            try:
+                for word in words:
+                    pending.append((word, executor.submit(_run, self._command(word))))
+                    while len(pending) >= window:
+                        failed += yield from self._output(*pending.popleft())
+
+                while pending:
+                    failed += yield from self._output(*pending.popleft())
+            finally:
+                # 下游提前结束时，取消还没有开始的命令
+                for _, future in pending:
+                    future.cancel()
+
+        return failed == 0
+
+    def _command(self, word):
+        if any('{}' in arg for arg in self.args):
+            return [arg.replace('{}', word) for arg in self.args]
+        return self.args + [word]
+
+    def _output(self, word, future):
+        """
+        按顺序输出一个命令收集到的行
+
+        :return: 命令失败时为1，否则为0
+        """
+        rv, lines = future.result()
+        for line in lines:
+            yield word + '\t' + line if self.tag else line
+        return 0 if succeeded(rv) else 1
+
+
+# 以下为辅助函数
+
+def _read_lines(stream):
+    for line in stream:
+        line = line.rstrip('\n')
+        if line:
+            yield line
+
+
+def _run(command):
+    """
+    在线程池中执行一个命令，收集它的输出。外部命令在自己的进程中执行，可以同时使用多个CPU
+    """
+    from ..manage.dispatch import dispatch
+
+    try:
+        # 输入流留给parallel读取参数，命令读到的是空的输入
+        with StdinRedirection(source=()).context():
+            with StdoutRedirection().context() as out:
+                rv = dispatch.dispatch(command[0], *command[1:])
+    except Exception as e:
+        return False, [str(e) + '\n']
+
+    return rv, out.pipe
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+from datetime import datetime
+
 from ..manage.env import Application
+from ..manage.usage import format_seconds, format_kilobytes
 
 app = Application()
 
@@ -7,36 +10,62 @@ app = Application()
 class ps:
     usage = """
 Usage:
-    ps：查看所有运行中的命令。
+    ps：查看所有运行中的命令，以及它们的执行时间(WALL)、CPU时间(USER/SYS)和最大内存(RSS，KB)。
+          内部命令与shell共用进程，没有自己的最大内存，显示为-。
+    ps -a：同时查看最近结束的命令。
     ps [name] [name] ...：查看给出名字的运行的命令。
     ps --help
             """
+    line = '{:<10}{:<10}{:<10}{:<10}{:>10}{:>10}{:>10}{:>10}  {}'
 
     def __init__(self, *args):
-        self.args = args
+        self.args = [arg for arg in args if arg != '-a']
+        self.all = '-a' in args
 
     def handler(self):
         if '--help' in self.args:
-            print(self.usage)
+            yield self.usage
             return True
         else:
-            process = self.env['Processing'].get_records()
-            print('{:<10}{:<10}{:<10}{:<10}'.format('PID', 'NAME', 'BACKEND', 'TIME'))
+            Processing = self.env['Processing']
+            process = Processing.get_records()
+            yield self.line.format('PID', 'NAME', 'BACKEND', 'STATE',
+                                   'WALL', 'USER', 'SYS', 'RSS', 'TIME')
+            if self.all:
+                for pid, record in Processing.finished:
+                    if not self.args or record['NAME'] in self.args:
+                        yield self._format(pid, record, 'done')
+
             if len(self.args) > 0:
+                # 按名字的索引查找，不遍历整个记录表
                 pids = []
                 for arg in self.args:
-                    pids += [pid
-                            for pid in process.keys()
-                            if process[pid]['NAME'] == arg]
+                    pids += Processing.find(arg)
             else:
-                pids = [pid for pid in process.keys()]
+                pids = list(process.keys())
 
             for pid in pids:
-                print('{:<10}{:<10}{:<10}{:<10}'.format(
-                    pid,
-                    process[pid]['NAME'],
-                    str(process[pid]['instance'].backend),
-                    str(process[pid]['TIME']),
-                ))
+                yield self._format(pid, process[pid], process[pid]['STATE'])
 
         return True
+
+    def _format(self, pid, record, state):
+        usage = record['USAGE']
+        if usage is None:
+            # 还在执行，只有墙上时间
+            wall, user, sys, maxrss = (datetime.now() - record['TIME']).total_seconds(), \
+                                      None, None, None
+        else:
+            wall, user, sys, maxrss = usage
+
+        return self.line.format(
+            pid,
+            record['NAME'],
+            str(record['instance'].backend),
+            state,
+            format_seconds(wall),
+            format_seconds(user),
+            format_seconds(sys),
+            format_kilobytes(maxrss),
+            str(record['TIME']),
+        )
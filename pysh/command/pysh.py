@@ -11,13 +11,15 @@ import sys
 from .exit import ShellExit
 from ..contrib.LineEdit import LineInput
 from ..contrib.parser import Parser
-from ..manage.env import Application
+from ..manage.env import Application, History
 
 app = Application()
 
 @app.register
 class pysh:
     line_symbol = '#'
+    # 后台启动的shell需要独立的进程
+    isolated = True
     logout = 'logout'
     slogan = """
     *******************************
@@ -65,6 +67,16 @@ Usage:
             else:
                 parser = Parser(raw_command)
 
+            while parser.incomplete:
+                # 控制语句还没有结束，继续读入
+                try:
+                    raw_command += ';\n' + input('...').strip()
+                except KeyboardInterrupt:
+                    print('\n')
+                    break
+                parser = Parser(raw_command)
+
+            History.record(raw_command)
             try:
                 parser.run()
             except EOFError:
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import sys
+
+from ..manage.env import Application
+from ..manage.usage import Meter, format_seconds, format_kilobytes
+
+app = Application()
+
+
+@app.register
+class time:
+    help = False
+    usage = """
+Usage:
+    time command [arg1] [arg2] ...：执行命令，结束后在标准错误中输出执行时间、CPU时间和外部命令的最大内存
+    time --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if not self.args or self.args[0] == '--help':
+            self.help = True
+
+    def handler(self):
+        if self.help:
+            print(self.usage)
+            return True
+
+        from ..manage.dispatch import dispatch
+
+        # 命令在这个线程中启动的外部命令在结束时被回收，计入子进程的资源使用
+        meter = Meter(children=True)
+        try:
+            rv = dispatch.dispatch(self.args[0], *self.args[1:])
+        finally:
+            wall, user, sys_time, maxrss = meter.stop()
+            sys.stdout.flush()
+            print('', file=sys.stderr)
+            print('real\t{}s'.format(format_seconds(wall)), file=sys.stderr)
+            print('user\t{}s'.format(format_seconds(user)), file=sys.stderr)
+            print('sys\t{}s'.format(format_seconds(sys_time)), file=sys.stderr)
+            print('maxrss\t{}KB'.format(format_kilobytes(maxrss)), file=sys.stderr)
+
+        return rv
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from ..manage.env import Application
+from ..manage.jobs import Jobs
+
+app = Application()
+
+
+@app.register
+class wait:
+    help = False
+    usage = """
+Usage:
+    wait：等待所有后台作业结束
+    wait [id1] [id2] ...：等待给出的作业结束，返回最后一个作业的退出码
+    wait --help：显示本帮助
+            """
+
+    def __init__(self, *args):
+        self.args = args or []
+        if '--help' in self.args:
+            self.help = True
+
+    def handler(self):
+        if self.help:
+            print(self.usage)
+            return True
+
+        ids = []
+        for arg in self.args:
+            job = Jobs.get(arg)
+            if job is None:
+                print('wait: {} 不是一个有效的作业'.format(arg))
+                return False
+            ids.append(job.id)
+
+        return Jobs.wait(ids or None)
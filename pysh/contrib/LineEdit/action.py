@@ -1,10 +1,16 @@
-import itertools
+import os
+import re
 import sys
 
 from pysh.command.exit import ShellExit
+from pysh.contrib.tools import getch
+from pysh.manage.env import History
 from pysh.manage.middleware import Completer
 from .line_edit import LineInput, KeyMapping, show_history, LineEndError
 
+# 最多列出的补全候选数，很大的目录不会刷屏
+MAX_CANDIDATES = 100
+
 
 @LineInput.add_action([KeyMapping.end1, KeyMapping.end2])
 def line_end(buffer):
@@ -22,34 +28,50 @@ def bksp(buffer):
 @LineInput.add_action([KeyMapping.completion])
 def completion(buffer):
     """
-    Tab键命令补全
+    Tab键补全。
+    命令的位置补全命令名、变量和历史命令；参数和重定向的位置补全文件路径，cd的参数只补全目录。
+    当前单词没有匹配时，仍然按整行补全历史命令。
     """
     if not buffer.content:
         return
 
     text = ''.join(buffer.content)
-    results = []
-    for num in itertools.count():
-        result = Completer.search_symbol(text, num)
-        if not result:
-            break
-        else:
-            results.append(result)
+    start, command = _word_position(text)
+    word = text[start:]
 
-    results = list(set(results))
+    if command is None and os.sep not in word:
+        results = Completer.complete(word)
+    else:
+        results = Completer.complete_path(word, only_dirs=command == 'cd')
+
+    prefix = text[:start]
+    if not results and prefix:
+        results = Completer.complete(text)
+        prefix = ''
 
     if len(results) == 1:
         buffer.clear()
-        buffer.content = list(results[0])
+        buffer.content = list(prefix + results[0])
     elif not results:
         return False
     else:
+        # 先补全到所有候选共同的前缀
+        common = os.path.commonprefix(results)
+        if len(prefix + common) > len(text):
+            buffer.clear()
+            buffer.content = list(prefix + common)
+
         print('\n')
-        for result in results:
+        for result in results[:MAX_CANDIDATES]:
             print(result, end=' ')
+        if len(results) > MAX_CANDIDATES:
+            print('... ({} more)'.format(len(results) - MAX_CANDIDATES), end='')
         print('\n')
 
-        print(buffer.slogan, ':', text, sep='', end='')
+        content = ''.join(buffer.content)
+        print(buffer.slogan, ':', content, sep='', end='')
+        buffer.showed = len(content)
+        buffer.offseted = buffer.offset
         sys.stdout.flush()
 
         return True
@@ -158,6 +180,48 @@ def swap_two_char(buffer):
     buffer.content[index], buffer.content[index - 1] = buffer.content[index - 1], buffer.content[index]
 
 
+@LineInput.add_action([KeyMapping.reverse_search])
+def reverse_search(buffer):
+    """
+    Ctrl + R 增量查找历史记录。
+    输入的文字立即查找最近包含它的命令，再按Ctrl + R查找更早的一条；
+    Ctrl + G取消查找，其它控制键接受找到的命令，再按原来的功能处理，比如回车直接执行。
+    """
+    original = list(buffer.content)
+    query = ''
+    result = None
+    _show_search(query, result)
+
+    while True:
+        char = getch().strip('\x00')
+        if not char:
+            continue
+
+        if char == KeyMapping.reverse_search:
+            if result is not None:
+                result = History.search(query, result[0]) or result
+        elif char in (KeyMapping.bksp, '\x7f'):
+            query = query[:-1]
+            result = History.search(query) if query else None
+        elif char == KeyMapping.cancel_search:
+            buffer.content = original
+            _restore_prompt(buffer)
+            return
+        elif len(char) == 1 and 32 <= ord(char) < 127:
+            query += char
+            # 加长之后仍然可能是当前这条命令，从它开始继续查找
+            result = History.search(query, None if result is None else result[0] + 1)
+        else:
+            if result is not None:
+                buffer.content = list(result[1])
+            _restore_prompt(buffer)
+            for ch in char:
+                LineInput._handler(ch, buffer)
+            return
+
+        _show_search(query, result)
+
+
 @LineInput.add_action([KeyMapping.exit_shell, KeyMapping.exit_program])
 def exit_shell(buffer):
     """
@@ -165,3 +229,42 @@ def exit_shell(buffer):
     """
     print('\n')
     raise ShellExit
+
+
+# 以下为辅助函数
+
+def _word_position(text):
+    """
+    找到正在输入的单词，判断它在命令中的位置
+
+    :param text: 整行内容
+    :return: (单词的开始位置, 所在命令的命令名)，单词是命令名时命令名为None，重定向的目标为空字符串
+    """
+    start = len(text)
+    while start > 0 and not text[start - 1].isspace() and text[start - 1] not in '<>|;&':
+        start -= 1
+
+    before = text[:start].rstrip()
+    if before.endswith(('<', '>')):
+        return start, ''
+
+    # 管道、分号和&之后是新的命令
+    words = re.split(r'[|;&]', before)[-1].split()
+    if not words:
+        return start, None
+    return start, words[0]
+
+
+def _show_search(query, result):
+    command = '' if result is None else result[1]
+    print('\r\x1b[K(reverse-i-search)`', query, "': ", command, sep='', end='')
+    sys.stdout.flush()
+
+
+def _restore_prompt(buffer):
+    """
+    清除查找的提示，重新打印提示符，之后由buffer.show打印内容
+    """
+    print('\r\x1b[K', buffer.slogan, ':', sep='', end='')
+    buffer.offset = buffer.showed = buffer.offseted = 0
+    sys.stdout.flush()
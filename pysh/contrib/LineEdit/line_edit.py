@@ -135,6 +135,8 @@ class KeyMapping:
     clear_prev_word = '\x17'  # ctrl + w
     clear_cursor_to_end = '\x0b'  # ctrl + k
     swap_two_char = '\x14'  # ctrl + t
+    reverse_search = '\x12'  # ctrl + r
+    cancel_search = '\x07'  # ctrl + g
     cursor_to_next = '\x06'  # ctrl + f
     cursor_to_prev = '\x02'  # ctrl + b
     home = '\x1b[1~'  # home键
@@ -277,15 +279,12 @@ class LineInput:
         """
         执行最近一条包含text的历史记录
         """
-        index = len(History.history) - 1
-        while index >= 0:
-            if text in History.history[index]:
-                print(History.history[index])
-                return History.history[index]
+        result = History.search(text)
+        if result is None:
+            return ''
 
-            index -= 1
-
-        return ''
+        print(result[1])
+        return result[1]
 
 
 def show_history(buffer, arrow):
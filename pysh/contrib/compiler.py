@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+编译pysh脚本。将脚本逐行解析为语法树的列表，以文件的修改时间和大小为依据缓存到磁盘。
+再次运行没有修改过的脚本时，跳过分割与解析，直接执行缓存的语法树。
+"""
+import hashlib
+import os
+import pickle
+
+from .grammar import Grammar, GrammarIncomplete, Redirect
+from .parser import Handler, tokenize
+
+
+class Compiler:
+    """
+    编译、缓存并执行脚本
+    """
+    # 语法树的结构改变时增加版本号，使旧的缓存失效
+    version = 6
+    cache_dir = os.path.join(os.path.expanduser('~'), '.pysh', 'scripts')
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.cache_path = os.path.join(
+            self.cache_dir,
+            hashlib.sha1(self.path.encode()).hexdigest() + '.pickle'
+        )
+
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            self.stamp = None
+        else:
+            self.stamp = (stat.st_mtime_ns, stat.st_size)
+
+    def load(self):
+        """
+        读取缓存的语法树。脚本修改过或缓存无效时返回None。
+
+        :return: 语法树列表
+        """
+        if self.stamp is None:
+            return None
+
+        try:
+            with open(self.cache_path, 'rb') as file:
+                cached = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+        if cached.get('version') != self.version \
+                or cached.get('path') != self.path \
+                or cached.get('stamp') != self.stamp:
+            return None
+
+        return cached['program']
+
+    def save(self, program):
+        """
+        写入缓存。先写临时文件再重命名，避免其它进程读到写了一半的缓存。
+        缓存目录不可写时直接放弃。
+        """
+        cached = {
+            'version': self.version,
+            'path': self.path,
+            'stamp': self.stamp,
+            'program': program,
+        }
+        tmp_path = self.cache_path + '.' + str(os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as file:
+                pickle.dump(cached, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        return True
+
+    def compile(self, lines):
+        """
+        将脚本的每一行解析为语法树，跨越多行的控制语句合并为一棵语法树。
+        标记式重定向输入的内容在编译时就从后续行读入。
+        有语法错误的行记为None，并且不写入缓存。
+
+        :param lines: 脚本的行
+        :return: 语法树列表
+        """
+        program = []
+        error = False
+        # 控制语句跨越多行时，暂存之前的行
+        pending = None
+        lines = iter(lines)
+        for line in lines:
+            source = line if pending is None else pending + ';\n' + line
+            try:
+                tree = Grammar(tokenize(source)).parse()
+            except GrammarIncomplete:
+                pending = source
+                continue
+            except ValueError as e:
+                print(e)
+                error = True
+                program.append(None)
+            else:
+                program.append(_here_document(tree, lines))
+            pending = None
+
+        if pending is not None:
+            print('脚本意外结束：控制语句没有结束')
+            error = True
+
+        if not error and self.stamp is not None:
+            self.save(program)
+
+        return program
+
+    def run(self, program):
+        """
+        依次执行语法树，遇到异常时停止
+        """
+        rv = True
+        for tree in program:
+            if tree is None:
+                continue
+
+            try:
+                Handler(tree).run()
+            except Exception as e:
+                print(e)
+                rv = False
+                break
+
+        return rv
+
+
+# 以下为辅助函数
+
+
+def _here_document(node, lines):
+    """
+    把语法树中的标记式重定向输入替换为编译时读入的内容
+
+    :param node: 语法树结点
+    :param lines: 脚本剩余行的迭代器
+    :return: 替换后的结点
+    """
+    if isinstance(node, tuple) and hasattr(node, '_fields'):
+        if isinstance(node, Redirect) and node.kind == 'double_left_angel' \
+                and isinstance(node.target, str) and node.target:
+            content = []
+            for line in lines:
+                if line.rstrip('\n') == node.target:
+                    break
+                content.append(line.rstrip('\n') + '\n')
+            return Redirect('here_document', tuple(content), _here_document(node.body, lines))
+
+        return node._make(_here_document(field, lines) for field in node)
+    elif isinstance(node, tuple):
+        return tuple(_here_document(item, lines) for item in node)
+
+    return node
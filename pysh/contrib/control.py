@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 """
-这里定义具体的各个符号和语句的行为，并由parser.Handler.run进行调用
+这里定义具体的各个符号和语句的行为，parser.Handler遍历语法树时，按结点类型调用
 """
+import inspect
 import os
-import re
+import threading
 from functools import partial
 
-from .keyword import Symbol, Keyword
-from .parser import Parser, Handler
+from .grammar import Command, Redirect
+from .keyword import Symbol
+from .parser import Parser
+from .tools import succeeded
 from ..command import pysh, exit
-from ..manage.env import Variable, EnvVariable
-from ..manage.middleware import StdoutRedirection, StdinRedirection
+from ..manage.dispatch import dispatch
+from ..manage.env import Application, Variable, EnvVariable, History
+from ..manage.middleware import StdoutRedirection, StdinRedirection, Feed, local_stdio, \
+    current_stdin, current_stdout, open_stream
 
 
 class SymbolAction:
@@ -86,46 +91,43 @@ class KeywordAction:
 # 以下注册符号行为
 
 @SymbolAction.register
-def semicolon(self, tokens):
+def semicolon(self, node):
     """
-    分割命令。
+    依次执行分割的命令。
     """
-    if Symbol.mapping['semicolon'].char in tokens:
-        tokens_list = Symbol.mapping['semicolon'].cls.handle(tokens)
-        self.handler.tokens = None
-        for tokens in tokens_list:
-            Handler(tokens).run()
+    rv = True
+    for item in node.items:
+        rv = self.handler.execute(item)
 
-        return
+    return rv
 
 
 @SymbolAction.register
-def backend(self, tokens):
+def backend(self, node):
     """
-    是否后台执行
+    后台执行。
+    单个命令（可以带重定向）直接在后台启动，后台标志只传给这个命令；
+    管道和控制语句整体作为一个作业执行，其中的命令按前台方式启动。
     """
-    backend = False
-    if tokens and tokens[-1] == Symbol.mapping['backend'].char:
-        self.handler.tokens = Symbol.mapping['backend'].cls.handle(tokens)
-        backend = True
+    body = node.body
+    if _simple(body):
+        return self.handler.execute(body, backend=True, daemon=node.daemon, join=node.join)
 
-    return backend
+    return dispatch.group(partial(self.handler.execute, body), _describe(body), join=node.join)
 
 
 @SymbolAction.register
-def double_and(self, tokens):
+def double_and(self, node):
     """
     逻辑与
     """
-    if Symbol.mapping['double_and'].char in tokens:
-        tokens_list = Symbol.mapping['double_and'].cls.handle(tokens)
-        self.handler.tokens = None
-        for tokens in tokens_list:
-            if Handler(tokens).run():
-                continue
-            else:
-                break
-        return
+    rv = True
+    for item in node.items:
+        rv = self.handler.execute(item)
+        if not succeeded(rv):
+            break
+
+    return rv
 
 
 @SymbolAction.register
@@ -134,8 +136,7 @@ def dollars(self, tokens):
     当前shell id
     """
     cls = Symbol.mapping['dollars'].cls
-    self.handler.tokens = cls.handle(tokens)
-    return
+    return cls.handle(tokens)
 
 
 @SymbolAction.register
@@ -144,19 +145,17 @@ def wave_line(self, tokens):
     用户目录
     """
     cls = Symbol.mapping['wave_line'].cls
-    self.handler.tokens = cls.handle(tokens)
-    return
+    return cls.handle(tokens)
 
 
 @SymbolAction.register
-def equal(self, tokens):
+def equal(self, node):
     """
     变量赋值
     """
-    cls = Symbol.mapping['equal'].cls
-    vr_mapping, self.handler.tokens = cls.handle(tokens)
-    Variable.variable.update(vr_mapping)
-    return
+    for name, value in node.pairs:
+        Variable.add(name, ''.join(self.handler.expand([value])))
+    return True
 
 
 @SymbolAction.register
@@ -165,234 +164,191 @@ def dollar(self, tokens):
     变量展开
     """
     cls = Symbol.mapping['dollar'].cls
-    self.handler.tokens = cls.handle(tokens)
-    return
+    return cls.handle(tokens)
 
 
 @SymbolAction.register
-def right_angel(self, tokens):
+def right_angel(self, node, **flags):
     """
     原来设想的输入输出重定向阶段，应该在分发应用那里，使用装饰器实现来着。
     可是，后来感觉这样解析参数、传来传去的太麻烦，还是就这样吧……
     """
-    cls = Symbol.mapping['right_angel'].cls
-    if cls.char in tokens:
-        file_path, self.handler.tokens = cls.handle(tokens)
-        try:
-            # 覆盖文件
-            sr = StdoutRedirection(file_path, file_override=True)
-        except FileNotFoundError as e:
-            print(e)
-            self.handler.tokens = None
-        except PermissionError as e:
-            print(e)
-            self.handler.tokens = None
-        else:
-            with sr.context():
-                Handler(self.handler.tokens).run()
-            self.handler.tokens = None
-    return
+    file_path = _target(self.handler, node)
+    try:
+        # 覆盖文件
+        sr = StdoutRedirection(file_path, file_override=True)
+    except FileNotFoundError as e:
+        print(e)
+        return False
+    except PermissionError as e:
+        print(e)
+        return False
+    else:
+        with sr.context():
+            return self.handler.execute(node.body, **flags)
 
 
 @SymbolAction.register
-def double_right_angel(self, tokens):
+def double_right_angel(self, node, **flags):
     """
     重定向
     """
-    cls = Symbol.mapping['double_right_angel'].cls
-    if cls.char in tokens:
-        file_path, self.handler.tokens = cls.handle(tokens)
-        try:
-            # 不覆盖文件
-            sr = StdoutRedirection(file_path, file_override=False)
-        except FileNotFoundError as e:
-            print(e)
-            self.handler.tokens = None
-        except PermissionError as e:
-            print(e)
-            self.handler.tokens = None
-        else:
-            with sr.context():
-                Handler(self.handler.tokens).run()
-            self.handler.tokens = None
-    return
+    file_path = _target(self.handler, node)
+    try:
+        # 不覆盖文件
+        sr = StdoutRedirection(file_path, file_override=False)
+    except FileNotFoundError as e:
+        print(e)
+        return False
+    except PermissionError as e:
+        print(e)
+        return False
+    else:
+        with sr.context():
+            return self.handler.execute(node.body, **flags)
 
 
 @SymbolAction.register
-def left_angel(self, tokens):
+def left_angel(self, node, **flags):
     """
     重定向输入流
     """
-    cls = Symbol.mapping['left_angel'].cls
-    if cls.char in tokens:
-        file_path, self.handler.tokens = cls.handle(tokens)
-        try:
-            si = StdinRedirection(file_path=file_path)
-        except FileNotFoundError as e:
-            print(e)
-            self.handler.tokens = None
-        except PermissionError as e:
-            print(e)
-            self.handler.tokens = None
-        else:
-            try:
-                with si.context():
-                    Handler(self.handler.tokens).run()
-            except UnicodeDecodeError as e:
-                # 指定一个非文本文件，读取时会弹出此错误
-                print(e)
-            finally:
-                self.handler.tokens = None
-    return
+    file_path = _target(self.handler, node)
+    try:
+        si = StdinRedirection(file_path=file_path)
+    except FileNotFoundError as e:
+        print(e)
+        return False
+    except PermissionError as e:
+        print(e)
+        return False
+    else:
+        # 以二进制方式打开，非文本文件也不会在读取时出错
+        with si.context():
+            return self.handler.execute(node.body, **flags)
 
 
 @SymbolAction.register
-def double_left_angel(self, tokens):
+def double_left_angel(self, node, **flags):
     """
     标记式重定向输入流
     """
-    cls = Symbol.mapping['double_left_angel'].cls
-    if cls.char in tokens:
-        tag, tokens = cls.handle(tokens)
+    tag = _target(self.handler, node)
+    if not tag:
+        return False
 
-        if tag:
-            pipe = []
-            while True:
-                token = input('...')
-                if token == tag:
-                    break
-                else:
-                    pipe.append(token + '\n')
-            si = StdinRedirection(source=pipe)
+    pipe = []
+    while True:
+        token = input('...')
+        if token == tag:
+            break
+        else:
+            pipe.append(token + '\n')
+    si = StdinRedirection(source=pipe)
 
-            try:
-                with si.context():
-                    Handler(self.handler.tokens).run()
-            except TypeError as e:
-                print(e)
-            finally:
-                self.handler.tokens = None
-    return
+    try:
+        with si.context():
+            return self.handler.execute(node.body, **flags)
+    except TypeError as e:
+        print(e)
+        return False
 
 
 @SymbolAction.register
-def back_quote(self, tokens):
+def here_document(self, node, **flags):
     """
-    命令替代
+    脚本中编译好的标记式重定向输入，内容在编译时已经读入
     """
-    cls = Symbol.mapping['back_quote'].cls
-    if cls.char in tokens:
-        sub_tokens = cls.handle(tokens)
-        if sub_tokens:
-            for token in sub_tokens:
-                sr = StdoutRedirection()
-                with sr.context() as out:
-                    Handler(token).run()
+    si = StdinRedirection(source=node.target)
 
-                raw_token = ''.join(out.pipe)
-                self.handler.raw_token = re.sub('`.*`',
-                                                raw_token,
-                                                self.handler.raw_token, 1)
-            Parser(self.handler.raw_token).run()
-            self.handler.tokens = None
-    return
+    try:
+        with si.context():
+            return self.handler.execute(node.body, **flags)
+    except TypeError as e:
+        print(e)
+        return False
 
 
 @SymbolAction.register
-def pipe(self, tokens):
-    """
-    前一个命令的输出作为下一个命令的输入
-    """
-    cls = Symbol.mapping['pipe'].cls
-    if cls.char in tokens:
-        tokens = cls.handle(tokens)
-        for index, token in enumerate(tokens):
-            if index == 0:
-                sr = StdoutRedirection()
-                with sr.context() as sr:
-                    Handler(token).run()
-            elif index == len(tokens) - 1:
-                si = StdinRedirection(source=sr.pipe)
-                with si.context():
-                    Handler(token).run()
-            else:
-                si = StdinRedirection(source=sr.pipe)
-                sr = StdoutRedirection()
-                with si.context(), sr.context() as sr:
-                    Handler(token).run()
-
-        self.handler.tokens = None
-    return
-
+def back_quote(self, node):
+    """
+    命令替代，返回替代后的单词列表
+    """
+    sr = StdoutRedirection()
+    with sr.context() as out:
+        self.handler.execute(node.body)
 
-# 以下注册关键字行为
+    return ''.join(out.pipe).split()
 
 
-@KeywordAction.register
-def daemon(self, tokens):
-    """
-    守护模式
-    """
-    daemon_map = Keyword.mapping['daemon']
-    daemon = False
-    if tokens and tokens[-1] == daemon_map.words:
-        self.handler.tokens = daemon_map.cls.handle(tokens)
-        daemon = True
+@SymbolAction.register
+def pipe(self, node):
+    """
+    前一个命令的输出作为下一个命令的输入。
+    所有阶段同时启动，阶段之间用os.pipe连接，数据边产生边消费。
+    外部命令直接拿到管道的文件描述符，内部命令在各自的线程中读写，最后一个阶段在当前线程执行。
+    以生成器方式输出的内部命令则直接作为下一个阶段的输入。
+    """
+    stages = node.stages
+    results = [None] * len(stages)
+    workers = []
+
+    stdin, own_stdin = current_stdin(), False
+    for index, stage in enumerate(stages[:-1]):
+        records = _stream(self.handler, stage, stdin, own_stdin)
+        if records is not None:
+            # 以生成器方式输出的内部命令，由下一个阶段按需拉取，不经过线程和管道
+            stdin, own_stdin = Feed(records), True
+            continue
+
+        read_fd, write_fd = os.pipe()
+        stdout = open_stream(write_fd, 'w')
+        worker = threading.Thread(
+            target=_run_stage,
+            args=(self.handler, stage, results, index, stdin, own_stdin, stdout, True),
+            daemon=True,
+        )
+        worker.start()
+        workers.append(worker)
+        stdin, own_stdin = open_stream(read_fd, 'r'), True
 
-    return daemon
+    try:
+        _run_stage(self.handler, stages[-1], results, len(stages) - 1,
+                   stdin, own_stdin, current_stdout(), False)
+    finally:
+        for worker in workers:
+            worker.join()
 
+    return results[-1]
 
-@KeywordAction.register
-def join(self, tokens):
-    """
-    阻塞模式
-    """
-    join_map = Keyword.mapping['join']
-    join = False
-    if join_map.words in tokens:
-        self.handler.tokens = join_map.cls.handle(tokens)
-        join = True
 
-    return join
+# 以下注册关键字行为
 
 
 @KeywordAction.register
-def export(self, tokens):
+def export(self, node):
     """
     设置环境变量
     """
-    export_map = Keyword.mapping['export']
-    if tokens and export_map.cls.words == tokens[0]:
-        vr_dict = export_map.cls.handle(tokens)[0]
-        self.handler.tokens = None
-
-        for key, value in vr_dict.items():
-            EnvVariable.set_env_variable(key, value)
+    for key, value in node.pairs:
+        EnvVariable.set_env_variable(key, ''.join(self.handler.expand([value])))
 
     return True
 
 
 @KeywordAction.register
-def exec(self, tokens):
+def exec(self, node):
     """
     exec命令
     """
-    cls = Keyword.mapping['exec']
-    if tokens and tokens[0] == cls.words:
-        tokens.pop(0)
-        if len(tokens) >= 1:
-            if tokens[0] == '>':
-                tokens.pop(0)
-                file_path = tokens[0]
-                exec_shell(file_path)
-                raise exit.ShellExit
-            else:
-                Handler(tokens).run()
-                self.handler.tokens = None
-                raise exit.ShellExit
+    if node.file_path is not None:
+        exec_shell(node.file_path)
+        raise exit.ShellExit
+    elif node.body is not None:
+        self.handler.execute(node.body)
+        raise exit.ShellExit
 
-        self.handler.tokens = tokens
-    return
+    return True
 
 
 # 辅助函数
@@ -410,6 +366,7 @@ def exec_shell(file_path):
             else:
                 parser = Parser(raw_command)
 
+            History.record(raw_command)
             try:
                 parser.run()
             except EOFError:
@@ -418,3 +375,99 @@ def exec_shell(file_path):
                 break
 
     return True
+
+
+def _simple(node):
+    """
+    是否是单个命令，或者带重定向的单个命令
+    """
+    while isinstance(node, Redirect):
+        node = node.body
+    return isinstance(node, Command)
+
+
+def _describe(node):
+    """
+    复合命令显示用的命令行
+    """
+    name = type(node).__name__
+    if name == 'Command':
+        return ' '.join(word if isinstance(word, str) else '`...`' for word in node.words)
+    elif name == 'Pipeline':
+        return ' | '.join(_describe(stage) for stage in node.stages)
+    elif name == 'AndList':
+        return ' && '.join(_describe(item) for item in node.items)
+    elif name == 'Redirect':
+        return '{} {} {}'.format(_describe(node.body), Symbol.mapping[node.kind].char,
+                                 node.target if isinstance(node.target, str) else '`...`')
+    return name.lower()
+
+
+def _target(handler, node):
+    """
+    展开重定向的目标，目标也可能是命令替代
+    """
+    return ' '.join(handler.expand([node.target]))
+
+
+def _run_stage(handler, stage, results, index, stdin, own_stdin, stdout, own_stdout):
+    """
+    执行管道中的一个阶段，结束后关闭属于这个阶段的管道端，使下一个阶段读到文件结尾。
+
+    :param own_stdin: stdin是否是这个阶段独占的管道端
+    :param own_stdout: stdout是否是这个阶段独占的管道端
+    """
+    try:
+        with local_stdio(stdin, stdout):
+            results[index] = handler.execute(stage)
+    except BrokenPipeError:
+        # 下一个阶段已经提前退出
+        results[index] = False
+    except exit.ShellExit:
+        # 管道中的exit只结束这个阶段
+        results[index] = False
+    finally:
+        for stream, own in ((stdout, own_stdout), (stdin, own_stdin)):
+            if own:
+                try:
+                    stream.close()
+                except BrokenPipeError:
+                    pass
+
+
+def _stream(handler, stage, stdin, own_stdin):
+    """
+    如果管道的这个阶段是以生成器方式输出的内部命令，返回产生它的输出的生成器，否则返回None。
+    只有命令名是字面量时才能预先判断，这样不会把单词展开两次。
+    """
+    if not isinstance(stage, Command) or not stage.words:
+        return None
+
+    command = stage.words[0]
+    if not isinstance(command, str) or '$' in command or command == '~' \
+            or not inspect.isgeneratorfunction(getattr(Application.app.get(command), 'handler', None)):
+        return None
+
+    tokens = handler.expand(stage.words)
+    records = dispatch.stream(tokens[0], *tokens[1:])
+    if records is None:
+        return None
+    return _bind_stdin(records, stdin, own_stdin)
+
+
+def _bind_stdin(records, stdin, own_stdin):
+    """
+    生成器在下一个阶段的线程中恢复执行，每次恢复时把输入流切换为它自己的输入
+    """
+    try:
+        while True:
+            with local_stdio(stdin=stdin):
+                try:
+                    record = next(records)
+                except StopIteration:
+                    return
+            yield record
+    finally:
+        records.close()
+        if own_stdin:
+            stdin.close()
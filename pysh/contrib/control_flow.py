@@ -1,22 +1,214 @@
 """
 实现控制流的模块。
 拦截待分发的命令，解析关键词，根据不同逻辑做出相应调度
+
+控制语句在grammar.Grammar中解析为语法树结点，循环体只解析一次，
+执行时由parser.Handler反复遍历同一棵语法树。
 """
+import re
+from collections import namedtuple
+
+from .tools import succeeded
+
+# 以下为控制语句的语法树结点
+
+While = namedtuple('While', ['condition', 'body'])
+For = namedtuple('For', ['name', 'words', 'body'])
+# clauses为(条件, 语句)的元组，orelse为else分支
+If = namedtuple('If', ['clauses', 'orelse'])
+Break = namedtuple('Break', ['level'])
+Continue = namedtuple('Continue', ['level'])
+
+
+class LoopControl(Exception):
+    """
+    break/continue通过异常跳出循环体。level为要跳出的循环层数
+    """
+
+    def __init__(self, level=1):
+        super().__init__(level)
+        self.level = level
+
+
+class LoopBreak(LoopControl):
+    pass
+
+
+class LoopContinue(LoopControl):
+    pass
+
 
 class ControlFlow:
     storage = {}
+    # 关键字与控制语句的对应关系，供语法分析使用
+    keywords = {}
+    # 语法树结点与控制语句的对应关系，供执行时使用
+    nodes = {}
 
     @classmethod
     def register(cls, control_cls):
         cls.storage.update({
             control_cls.__name__:control_cls,
         })
+        cls.keywords[control_cls.keyword] = control_cls
+        cls.nodes[control_cls.node.__name__] = control_cls
         return control_cls
 
 
 @ControlFlow.register
 class WhileControl:
+    """
+    while cond; do body; done
+    """
     keyword = 'while'
+    node = While
+    derc = '条件成立时重复执行'
+
+    @classmethod
+    def parse(cls, grammar):
+        grammar.expect(cls.keyword)
+        condition = grammar.sequence(('do',))
+        grammar.expect('do')
+        body = grammar.sequence(('done',))
+        grammar.expect('done')
+        return cls.node(condition, body)
+
+    @classmethod
+    def run(cls, handler, node):
+        rv = True
+        while succeeded(handler.execute(node.condition)):
+            try:
+                rv = handler.execute(node.body)
+            except LoopBreak as e:
+                if e.level > 1:
+                    e.level -= 1
+                    raise
+                break
+            except LoopContinue as e:
+                if e.level > 1:
+                    e.level -= 1
+                    raise
+        return rv
+
 
-    def __init__(self):
-        pass
+@ControlFlow.register
+class ForControl:
+    """
+    for name in word1 word2 ...; do body; done
+    """
+    keyword = 'for'
+    node = For
+    derc = '依次将单词赋值给变量并执行'
+
+    @classmethod
+    def parse(cls, grammar):
+        grammar.expect(cls.keyword)
+        name = grammar.word()
+        if not re.match(r'^[a-zA-Z][a-zA-Z1-9]*$', name):
+            raise ValueError('{} 不是一个有效的变量名'.format(name))
+        grammar.expect('in')
+        words = grammar.words()
+        # 单词列表和do之间只能有分号
+        grammar.semicolons()
+        grammar.expect('do')
+        body = grammar.sequence(('done',))
+        grammar.expect('done')
+        return cls.node(name, words, body)
+
+    @classmethod
+    def run(cls, handler, node):
+        from ..manage.env import Variable
+
+        rv = True
+        # 单词在进入循环时展开一次
+        for value in handler.expand(node.words):
+            Variable.add(node.name, value)
+            try:
+                rv = handler.execute(node.body)
+            except LoopBreak as e:
+                if e.level > 1:
+                    e.level -= 1
+                    raise
+                break
+            except LoopContinue as e:
+                if e.level > 1:
+                    e.level -= 1
+                    raise
+        return rv
+
+
+@ControlFlow.register
+class IfControl:
+    """
+    if cond; then body; elif cond; then body; else body; fi
+    """
+    keyword = 'if'
+    node = If
+    derc = '条件判断'
+
+    @classmethod
+    def parse(cls, grammar):
+        grammar.expect(cls.keyword)
+        clauses = []
+        orelse = None
+        while True:
+            condition = grammar.sequence(('then',))
+            grammar.expect('then')
+            body = grammar.sequence(('elif', 'else', 'fi'))
+            clauses.append((condition, body))
+
+            token = grammar.word()
+            if token == 'elif':
+                continue
+            elif token == 'else':
+                orelse = grammar.sequence(('fi',))
+                grammar.expect('fi')
+            break
+
+        return cls.node(tuple(clauses), orelse)
+
+    @classmethod
+    def run(cls, handler, node):
+        for condition, body in node.clauses:
+            if succeeded(handler.execute(condition)):
+                return handler.execute(body)
+
+        if node.orelse is not None:
+            return handler.execute(node.orelse)
+        return True
+
+
+@ControlFlow.register
+class BreakControl:
+    """
+    break [n]
+    """
+    keyword = 'break'
+    node = Break
+    derc = '跳出循环'
+    exception = LoopBreak
+
+    @classmethod
+    def parse(cls, grammar):
+        grammar.expect(cls.keyword)
+        level = 1
+        word = grammar.peek_word()
+        if word is not None and word.isdigit():
+            grammar.word()
+            level = max(int(word), 1)
+        return cls.node(level)
+
+    @classmethod
+    def run(cls, handler, node):
+        raise cls.exception(node.level)
+
+
+@ControlFlow.register
+class ContinueControl(BreakControl):
+    """
+    continue [n]
+    """
+    keyword = 'continue'
+    node = Continue
+    derc = '跳过本次循环'
+    exception = LoopContinue
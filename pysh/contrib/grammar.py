@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+语法分析。将shlex分割后的tokens一次性解析为语法树，交给parser.Handler遍历执行。
+
+原来每个符号行为各自在tokens里查找、分割一遍，遇到嵌套结构又新建Handler从头再来一遍。
+现在符号只在这里扫描一次，语法树中的结点都是不可变的，可以被缓存、反复执行。
+变量、用户目录等与执行环境有关的展开，留到执行时再做。
+"""
+from collections import namedtuple
+
+from .control_flow import ControlFlow
+from .keyword import Symbol, Keyword
+
+# 以下为语法树的结点
+
+# 分号分割的多条语句
+Sequence = namedtuple('Sequence', ['items'])
+# 逻辑与连接的多条语句
+AndList = namedtuple('AndList', ['items'])
+# 管道连接的多个命令
+Pipeline = namedtuple('Pipeline', ['stages'])
+# 后台执行
+Background = namedtuple('Background', ['body', 'daemon', 'join'])
+# 重定向。kind为对应符号行为的名字，如right_angel
+Redirect = namedtuple('Redirect', ['kind', 'target', 'body'])
+# 简单命令。words中除了字符串，还可能有Substitution结点
+Command = namedtuple('Command', ['words'])
+# 命令替代，body为反引号中的语法树
+Substitution = namedtuple('Substitution', ['body'])
+# 变量赋值，pairs为(变量名, 值)的元组
+Assignment = namedtuple('Assignment', ['pairs'])
+# 设置环境变量
+Export = namedtuple('Export', ['pairs'])
+# exec语句。body为要执行的语法树，file_path为整体重定向shell输出的文件
+Exec = namedtuple('Exec', ['body', 'file_path'])
+
+
+class GrammarError(ValueError):
+    pass
+
+
+class GrammarIncomplete(GrammarError):
+    """
+    命令还没有结束，比如控制语句缺少结尾的关键字，需要继续读入
+    """
+    pass
+
+
+class Grammar:
+    """
+    递归下降的语法分析器。
+
+    语法的优先级从低到高为：分号(;)、后台(&)、逻辑与(&&)、管道(|)、重定向与命令替代。
+    """
+
+    def __init__(self, tokens):
+        tokens = filter(lambda token: token, tokens)
+        self.tokens = list(filter(lambda token: token, map(lambda token: token.strip(), tokens)))
+        self.index = 0
+
+        self.semicolon = Symbol.mapping['semicolon'].char
+        self.backend = Symbol.mapping['backend'].char
+        self.double_and = Symbol.mapping['double_and'].char
+        self.pipe = Symbol.mapping['pipe'].char
+        self.back_quote = Symbol.mapping['back_quote'].char
+        self.redirect = {
+            Symbol.mapping[name].char: name
+            for name in ('right_angel', 'double_right_angel', 'left_angel', 'double_left_angel')
+        }
+        self.separator = {self.semicolon, self.backend, self.double_and, self.pipe}
+
+    def parse(self):
+        """
+        解析全部tokens。
+
+        :return: 语法树的根结点
+        """
+        if self.tokens and self.tokens[0] == Keyword.mapping['exec'].words:
+            return self._exec()
+
+        return self.sequence()
+
+    def _peek(self):
+        try:
+            return self.tokens[self.index]
+        except IndexError:
+            return None
+
+    def _next(self):
+        token = self._peek()
+        self.index += 1
+        return token
+
+    def _exec(self):
+        """
+        exec语句作用于整行命令
+        """
+        tokens = self.tokens[1:]
+        if tokens and tokens[0] == Symbol.mapping['right_angel'].char:
+            file_path = tokens[1] if len(tokens) > 1 else ''
+            return Exec(None, file_path)
+        elif tokens:
+            return Exec(Grammar(tokens).parse(), None)
+        else:
+            return Exec(None, None)
+
+    def expect(self, word):
+        """
+        读入指定的关键字，供控制语句使用
+        """
+        token = self._next()
+        if token is None:
+            raise GrammarIncomplete('缺少 {}'.format(word))
+        elif token != word:
+            raise GrammarError('语法错误：应为 {}，而不是 {}'.format(word, token))
+        return token
+
+    def word(self):
+        """
+        读入一个普通单词，供控制语句使用
+        """
+        token = self._next()
+        if token is None:
+            raise GrammarIncomplete('命令没有结束')
+        elif token in self.separator or token == self.back_quote:
+            raise GrammarError('语法错误：{}'.format(token))
+        return token
+
+    def words(self):
+        """
+        读入直到分割符号的所有单词，供控制语句使用
+        """
+        words = []
+        while True:
+            token = self._peek()
+            if token is None or token in self.separator:
+                break
+
+            self._next()
+            if token == self.back_quote:
+                words.append(self._substitution())
+            else:
+                words.append(token)
+        return tuple(words)
+
+    def semicolons(self):
+        """
+        跳过连续的分号，供控制语句使用
+        """
+        while self._peek() == self.semicolon:
+            self._next()
+
+    def peek_word(self):
+        """
+        查看下一个单词但不读入，遇到分割符号时返回None
+        """
+        token = self._peek()
+        if token in self.separator:
+            return None
+        return token
+
+    def sequence(self, stops=()):
+        """
+        解析多条语句，直到遇到stops中的关键字。
+
+        :param stops: 结束关键字，只在语句开头识别
+        :return: 语法树结点
+        """
+        items = []
+        while True:
+            token = self._peek()
+            if token is None:
+                if stops:
+                    raise GrammarIncomplete('缺少 {}'.format(' 或 '.join(stops)))
+                break
+            elif token in stops:
+                break
+            elif token == self.semicolon:
+                self._next()
+                continue
+
+            item = self._and_list()
+            if item is not None:
+                items.append(item)
+
+        if len(items) == 1:
+            return items[0]
+        return Sequence(tuple(items))
+
+    def _and_list(self):
+        items = []
+        while True:
+            item = self._pipeline()
+            token = self._peek()
+
+            if not _empty(item):
+                items.append(item)
+
+            if token == self.double_and:
+                self._next()
+            else:
+                break
+
+        if not items:
+            node = None
+        elif len(items) == 1:
+            node = items[0]
+        else:
+            node = AndList(tuple(items))
+
+        if token == self.backend:
+            # 后台符号结束当前语句，像分号一样，整个&&连接的语句作为一个作业在后台执行
+            self._next()
+            node = self._background(node if node is not None else item)
+        return node
+
+    def _background(self, node):
+        """
+        后台执行，并识别守护、阻塞关键字
+        """
+        daemon_cls = Keyword.mapping['daemon'].cls
+        join_cls = Keyword.mapping['join'].cls
+
+        command = _last_command(node)
+        words = list(command.words) if command else []
+        daemon = bool(words) and words[-1] == daemon_cls.words
+        if daemon:
+            words = daemon_cls.handle(words)
+        join = join_cls.words in words
+        if join:
+            words = join_cls.handle(words)
+
+        if command:
+            node = _replace_last_command(node, command._replace(words=tuple(words)))
+
+        return Background(node, daemon, join)
+
+    def _pipeline(self):
+        stages = [self._command()]
+        while self._peek() == self.pipe:
+            self._next()
+            stages.append(self._command())
+
+        if len(stages) == 1:
+            return stages[0]
+        return Pipeline(tuple(stages))
+
+    def _command(self):
+        words = []
+        redirects = []
+        node = None
+
+        control_cls = ControlFlow.keywords.get(self._peek())
+        if control_cls:
+            # 控制语句，只允许后面跟重定向
+            node = control_cls.parse(self)
+
+        while True:
+            token = self._peek()
+            if token is None or token in self.separator:
+                break
+
+            self._next()
+            if token in self.redirect:
+                target = self._peek()
+                if target is None or target in self.separator or target in self.redirect:
+                    target = ''
+                elif target == self.back_quote:
+                    self._next()
+                    target = self._substitution()
+                else:
+                    self._next()
+                redirects.append((self.redirect[token], target))
+            elif node is not None:
+                raise GrammarError('语法错误：{}'.format(token))
+            elif token == self.back_quote:
+                words.append(self._substitution())
+            else:
+                words.append(token)
+
+        if node is None:
+            node = self._simple(words)
+
+        # 先出现的重定向在外层
+        for kind, target in reversed(redirects):
+            node = Redirect(kind, target, node)
+
+        return node
+
+    def _simple(self, words):
+        """
+        区分变量赋值、环境变量和普通命令
+        """
+        export_cls = Keyword.mapping['export'].cls
+        if words and words[0] == export_cls.words:
+            mapping, _ = export_cls.handle(words)
+            return Export(tuple(mapping.items()))
+
+        mapping, words = Symbol.mapping['equal'].cls.handle(words)
+        if mapping and not words:
+            return Assignment(tuple(mapping.items()))
+
+        # 如果后面有其它语句，前面的设置变量的语句就无效
+        # 模仿bash的行为
+        return Command(tuple(words))
+
+    def _substitution(self):
+        """
+        反引号之间的tokens单独解析为一棵语法树
+        """
+        try:
+            end = self.tokens.index(self.back_quote, self.index)
+        except ValueError:
+            raise GrammarError('没有闭合的反引号')
+
+        body = Grammar(self.tokens[self.index:end]).parse()
+        self.index = end + 1
+        return Substitution(body)
+
+
+# 以下为辅助函数
+
+
+def _empty(node):
+    return isinstance(node, Command) and not node.words
+
+
+def _last_command(node):
+    """
+    找到语句中最后一个简单命令，后台相关的关键字写在它的末尾
+    """
+    if isinstance(node, Command):
+        return node
+    elif isinstance(node, Redirect):
+        return _last_command(node.body)
+    elif isinstance(node, Pipeline):
+        return _last_command(node.stages[-1])
+    elif isinstance(node, AndList):
+        return _last_command(node.items[-1])
+    return None
+
+
+def _replace_last_command(node, command):
+    if isinstance(node, Command):
+        return command
+    elif isinstance(node, Redirect):
+        return node._replace(body=_replace_last_command(node.body, command))
+    elif isinstance(node, Pipeline):
+        stages = node.stages[:-1] + (_replace_last_command(node.stages[-1], command),)
+        return node._replace(stages=stages)
+    elif isinstance(node, AndList):
+        items = node.items[:-1] + (_replace_last_command(node.items[-1], command),)
+        return node._replace(items=items)
+    return node
+
+
+def parse(tokens):
+    """
+    将tokens解析为语法树的快捷函数
+    """
+    return Grammar(tokens).parse()
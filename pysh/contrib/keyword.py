@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """"
-注册特殊符号或关键字。对tokens做一些与符号本身相关必要的处理（如清洗），具体的调用逻辑交给parser.Handle,
-复杂的行为交给control.SymbolAction/control.KeywordAction。
+注册特殊符号或关键字。对tokens做一些与符号本身相关必要的处理（如清洗），符号的识别和组合交给grammar.Grammar，
+具体的调用逻辑交给parser.Handler, 复杂的行为交给control.SymbolAction/control.KeywordAction。
 
 类应该按照功能命名而非符号。然而自从开始的几个类名没留意后，惯性的力量是巨大的……
 """
@@ -85,32 +85,6 @@ class Semicolon:
     name = 'semicolon'
     derc = '分割多条命令'
 
-    @classmethod
-    def handle(cls, tokens):
-        """
-        返回经cls.chars分割后的tokens列表。
-
-        :param tokens: 等待分割的tokens
-        :return: 分割后的列表
-        """
-        token_list = []
-
-        def split(tokens):
-            nonlocal token_list
-            if cls.char in tokens:
-                flag = tokens.index(cls.char)
-                token_list.append(tokens[0:flag])
-                tokens = tokens[flag + 1:]
-                split(tokens)
-            else:
-                if tokens:
-                    token_list.append(tokens)
-                return
-
-        split(tokens)
-
-        return token_list
-
 
 @Symbol.register
 class Backend:
@@ -121,16 +95,6 @@ class Backend:
     name = 'backend'
     derc = '启动多进程'
 
-    @classmethod
-    def handle(cls, tokens):
-        """
-        简单的去掉符号并返回，逻辑交给parser中的handler。
-        :param tokens:
-        :return:
-        """
-        tokens = tokens[:-1]
-        return tokens
-
 
 @Symbol.register
 class DoubleAnd:
@@ -141,20 +105,6 @@ class DoubleAnd:
     name = 'double_and'
     derc = '逻辑与'
 
-    @classmethod
-    def handle(cls, tokens):
-        """
-        像semicolon那样分割列表
-        :param tokens:
-        :return:
-        """
-        tokens = [
-            token if token != cls.char else Semicolon.char
-            for token in tokens
-        ]
-
-        return Semicolon.handle(tokens)
-
 
 @Symbol.register
 class Dollars:
@@ -168,6 +118,10 @@ class Dollars:
     @classmethod
     def handle(cls, tokens):
         symbol = cls.char
+        if not any(symbol in token for token in tokens):
+            # 没有$$时不必查询shell id
+            return tokens
+
         shell_id = get_shell_id()
         tokens = list(map(
             lambda token: token.replace(symbol, str(shell_id))
@@ -207,23 +161,27 @@ class Equal:
     char = '='
     name = 'equal'
     derc = '变量赋值'
+    re_str = r'^[a-zA-Z][a-zA-Z1-9]*=.+$'
 
     @classmethod
     def handle(cls, tokens):
-        re_str = r'^[a-zA-Z][a-zA-Z1-9]*=.+$'
-        variable_mapping = {}
-        for token in list(tokens):
-            # 如果都是设置变量的语句，就记录
-            if re.match(re_str, token):
-                vr_pair = token.split('=')
-                variable_mapping.update({vr_pair[0]: vr_pair[1]})
-                tokens.pop(tokens.index(token))
+        """
+        取出开头连续的变量赋值语句。
+
+        :param tokens: 语法分析中的单词，可能包含命令替代等非字符串结点
+        :return: (变量名和值的有序字典, 剩余的tokens)
+        """
+        variable_mapping = OrderedDict()
+        index = 0
+        for token in tokens:
+            if isinstance(token, str) and re.match(cls.re_str, token):
+                # 值里面也可能有等号
+                name, value = token.split('=', 1)
+                variable_mapping[name] = value
+                index += 1
             else:
-                # 如果后面有其它语句，前面的设置变量的语句就无效
-                # 模仿bash的行为
-                variable_mapping.clear()
                 break
-        return (variable_mapping, tokens)
+        return (variable_mapping, list(tokens[index:]))
 
 
 @Symbol.register
@@ -253,12 +211,6 @@ class BackQuote:
     name = 'back_quote'
     derc = '命令替代'
 
-    @classmethod
-    def handle(cls, tokens):
-        sub_tokens = []
-        get_sub_tokens(sub_tokens, tokens)
-        return sub_tokens
-
 
 @Symbol.register
 class RightAngel:
@@ -269,20 +221,6 @@ class RightAngel:
     name = 'right_angel'
     derc = '覆盖式重定向输出'
 
-    @classmethod
-    def handle(cls, tokens):
-        index = tokens.index(cls.char)
-        try:
-            tag = tokens[index + 1]
-        except IndexError:
-            tag = ''
-            tokens.pop(index)
-        else:
-            tokens.pop(index)
-            tokens.pop(index)
-
-        return tag, tokens
-
 
 @Symbol.register
 class DoubleRightAngel:
@@ -293,20 +231,6 @@ class DoubleRightAngel:
     name = 'double_right_angel'
     derc = '非覆盖式重定向输出'
 
-    @classmethod
-    def handle(cls, tokens):
-        index = tokens.index(cls.char)
-        try:
-            tag = tokens[index + 1]
-        except IndexError:
-            tag = ''
-            tokens.pop(index)
-        else:
-            tokens.pop(index)
-            tokens.pop(index)
-
-        return tag, tokens
-
 
 @Symbol.register
 class LeftAngel:
@@ -317,20 +241,6 @@ class LeftAngel:
     name = 'left_angel'
     derc = '重定向输入'
 
-    @classmethod
-    def handle(cls, tokens):
-        index = tokens.index(cls.char)
-        try:
-            tag = tokens[index + 1]
-        except IndexError:
-            tag = ''
-            tokens.pop(index)
-        else:
-            tokens.pop(index)
-            tokens.pop(index)
-
-        return tag, tokens
-
 
 @Symbol.register
 class DoubleLeftAngel:
@@ -342,20 +252,6 @@ class DoubleLeftAngel:
     name = 'double_left_angel'
     derc = '标记式重定向输入'
 
-    @classmethod
-    def handle(cls, tokens):
-        index = tokens.index(cls.char)
-        try:
-            tag = tokens[index + 1]
-        except IndexError:
-            tag = ''
-            tokens.pop(index)
-        else:
-            tokens.pop(index)
-            tokens.pop(index)
-
-        return tag, tokens
-
 
 @Symbol.register
 class Pipe:
@@ -366,14 +262,6 @@ class Pipe:
     name = 'pipe'
     derc = '前一个命令的输出，作为下一个命令的输入'
 
-    @classmethod
-    def handle(cls, tokens):
-        if cls.char in tokens:
-            index = [index
-                     for index, value in enumerate(tokens)
-                     if value == cls.char]
-            return split_tokens(tokens, index)
-
 
 # 以下为关键字注册
 
@@ -434,10 +322,6 @@ class Exec:
     name = 'exec'
     derc = '执行单条命令/重定向shell输出'
 
-    @classmethod
-    def handle(cls, tokens):
-        return tokens
-
 
 # 以下为辅助函数
 
@@ -446,12 +330,10 @@ def get_shell_id():
     """
     得到当前shell id
     """
-    processing = Processing.get_records()
-    shell_processing = list(filter(
-        lambda id: True if processing[id]['NAME'] == 'pysh' else False,
-        processing
-    ))
-    return list(shell_processing)[-1]
+    shell_id = Processing.last('pysh')
+    if shell_id is None:
+        raise IndexError('没有正在运行的pysh')
+    return shell_id
 
 
 def variable_replace(token):
@@ -466,65 +348,3 @@ def variable_replace(token):
         token = token.replace(vr_declare, vr)
 
     return token
-
-
-def get_sub_tokens(sub_tokens, tokens):
-    """
-    递归清洗tokens，得到所有子命令
-
-    :param sub_tokens: 收集子命令的列表
-    :param tokens: 原token
-    :return: sub_tokens
-    """
-    sub_token = []
-    try:
-        bq_1 = tokens.index(BackQuote.char)
-    except ValueError:
-        return sub_tokens
-    else:
-        find = False
-        for token in tokens[bq_1 + 1:]:
-            if token != BackQuote.char:
-                sub_token.append(token)
-            else:
-                find = True
-                break
-        else:
-            sub_token.clear()
-
-        if find:
-            tokens.pop(bq_1)
-            bq_2 = tokens.index(BackQuote.char)
-            sub_tokens.append(sub_token)
-            try:
-                get_sub_tokens(sub_tokens, tokens[bq_2 + 1:])
-            except IndexError:
-                return sub_tokens
-        else:
-            return sub_tokens
-
-
-def split_tokens(tokens, index):
-    """
-    用于管道功能，按管道出现位置分割命令
-
-    :param tokens: 初步分割后的命令列表
-    :param index: 管道在列表中出现的位置列表
-    :return: 分割后的列表
-    """
-    result = [[]]
-    result[-1].extend(tokens[0:index[0]])
-    for i, _ in enumerate(index):
-        result.append([])
-        if i < len(index) - 1:
-            try:
-                result[-1].extend(
-                    tokens[index[i] + 1:index[i + 1]]
-                )
-            except IndexError:
-                result.pop(-1)
-                break
-    result[-1].extend(
-        tokens[index[i] + 1:]
-    )
-    return result
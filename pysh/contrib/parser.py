@@ -1,191 +1,245 @@
 # -*- coding: utf-8 -*-
 """
-解析输入的命令。如果命令有特殊符号，执行特殊符号指定的操作。如果命令有控制语句，将解析之后的命令列表交给控制语句。
+解析输入的命令。先由shlex做词法分割，再由grammar.Grammar一次性解析为语法树，最后由Handler遍历语法树执行。
+如果命令有特殊符号，执行特殊符号指定的操作。如果命令有控制语句，将解析之后的语法树交给控制语句。
 """
+from collections import OrderedDict
 from shlex import shlex
 
+from .control_flow import ControlFlow, LoopControl
+from .grammar import Grammar, GrammarError, GrammarIncomplete
 from ..manage.dispatch import dispatch
 
+# 分割命令时代替{}的私用区字符
+_placeholder = '\ue000'
+
+
+class ParseCache:
+    """
+    缓存解析过的命令。以原始命令为键，保存分割后的tokens和语法树。
+    历史命令和脚本里的命令常常重复执行，不必每次都重新分割、解析。
+    语法树不包含变量展开的结果，所以可以放心复用。
+    """
+    maxsize = 1024
+    storage = OrderedDict()
+    hits = 0
+    misses = 0
+
+    @classmethod
+    def get(cls, token):
+        """
+        查找缓存，命中时将其移到最近使用的位置。
+
+        :param token: 原始命令
+        :return: (tokens, 语法树)，没有缓存时返回None
+        """
+        try:
+            entry = cls.storage[token]
+        except KeyError:
+            cls.misses += 1
+            return None
+
+        cls.storage.move_to_end(token)
+        cls.hits += 1
+        return entry
+
+    @classmethod
+    def put(cls, token, tokens, tree):
+        cls.storage[token] = (tuple(tokens), tree)
+        cls.storage.move_to_end(token)
+        while len(cls.storage) > cls.maxsize:
+            # 淘汰最久没有使用的命令
+            cls.storage.popitem(last=False)
+        return True
+
+    @classmethod
+    def new_maxsize(cls, value):
+        """
+        修改最大缓存数量，超出的部分立即淘汰。
+
+        :param value: 最大缓存数量
+        :return: None
+        """
+        cls.maxsize = int(value)
+        while len(cls.storage) > cls.maxsize:
+            cls.storage.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        cls.storage.clear()
+        cls.hits = 0
+        cls.misses = 0
+
+    @classmethod
+    def info(cls):
+        return OrderedDict([
+            ('size', len(cls.storage)),
+            ('maxsize', cls.maxsize),
+            ('hits', cls.hits),
+            ('misses', cls.misses),
+        ])
+
 
 class Parser:
     def __init__(self, token):
         """
-        对输入的命令做初步分割处理，然后委派给后续类。
+        对输入的命令做初步分割处理，解析为语法树，然后委派给后续类。
 
         :param token: 输入的命令
         """
         self.token = token
+        self.tree = None
+        # 控制语句没有结束时为True，需要继续读入
+        self.incomplete = False
 
-        self.shlex = shlex(self.token, punctuation_chars=True)
-        self.shlex.wordchars += '$.\//:'
+        entry = ParseCache.get(self.token)
+        if entry is not None:
+            self.tokens, self.tree = entry
+            return
 
         try:
-            self.tokens = list(self.shlex)
+            self.tokens = tokenize(self.token)
+            self.tree = Grammar(self.tokens).parse()
+        except GrammarIncomplete:
+            self.incomplete = True
+            return
         except ValueError as e:
+            # GrammarError也是ValueError的子类
             print(e)
             return
 
+        ParseCache.put(self.token, self.tokens, self.tree)
+
     def run(self):
-        Handler(self).run()
+        return Handler(self).run()
 
 
 class Handler:
     """
-    对初步分割之后的命令做进一步处理，并执行
+    遍历语法树并执行。每种结点对应control中注册的一个行为。
     """
-    _tokens = None
+    # 结点类型与符号行为的对应关系
+    symbol_actions = {
+        'Sequence': 'semicolon',
+        'AndList': 'double_and',
+        'Pipeline': 'pipe',
+        'Background': 'backend',
+        'Substitution': 'back_quote',
+        'Assignment': 'equal',
+    }
+    # 结点类型与关键字行为的对应关系
+    keyword_actions = {
+        'Export': 'export',
+        'Exec': 'exec',
+    }
 
     def __init__(self, parser):
-        try:
-            tokens = parser.tokens
-            self.raw_token = parser.token
-        except AttributeError:
-            # 传入Parser的实例对Handler进行初始化是后来为命令替代改变的特性
-            # 原来是直接传入分割后的tokens
-            # 所以加入try以适应旧的调用方式
-            try:
-                tokens = parser
-                self.raw_token = ' '.join(parser)
-            except TypeError as e:
-                print(e)
-                return
-
-        tokens = list(filter(lambda token: token, tokens))
-        self.tokens = list(map(lambda token: token.strip(), tokens))
-
-    @property
-    def tokens(self):
-        return self._tokens
-
-    @tokens.setter
-    def tokens(self, tokens):
         """
-        tokens是一个特殊属性，在tokens发生改变时，同步修改command和args.
-
-        :param tokens: 变更的tokens
-        :return: None
+        :param parser: Parser的实例，或者语法树的结点。
+        为了兼容原来的调用方式，也可以直接传入分割后的tokens
         """
-        self.args = None
-        self.command = None
-
-        self._tokens = tokens
-
-        if self.tokens:
-            self.command = self.tokens[0]
-            if len(self.tokens) > 1:
-                self.args = self.tokens[1:]
-
-    def _unfold_literal(self):
-        """
-        展开字面量
-        """
-        if self.tokens:
-            # 展开shell pid
-            self.sa.dollars(self.tokens)
-            # 展开用户目录
-            self.sa.wave_line(self.tokens)
-            # 设置变量
-            self.sa.equal(self.tokens)
-            # 展开变量
-            self.sa.dollar(self.tokens)
-            # 环境变量
-            self.ka.export(self.tokens)
+        if isinstance(parser, Parser):
+            self.tree = parser.tree
+        elif isinstance(parser, (list, tuple)) and not hasattr(parser, '_fields'):
+            try:
+                self.tree = Grammar(parser).parse()
+            except GrammarError as e:
+                print(e)
+                self.tree = None
+        else:
+            self.tree = parser
 
-    def _backend(self):
-        """
-        后台启动相关判断
+    def expand(self, words):
         """
-        # 是否后台启动
-        backend = self.sa.backend(self.tokens)
-        daemon = False
-        join = False
-        if backend:
-            # 是否守护模式、阻塞
-            daemon = self.ka.daemon(self.tokens)
-            join = self.ka.join(self.tokens)
-
-        self.backend = backend
-        self.daemon = daemon
-        self.join = join
+        展开单词：命令替代、shell pid、用户目录和变量。
+        这些都和执行时的环境有关，所以不在语法分析时展开。
 
-    def _redirect(self):
+        :param words: 语法树中的单词
+        :return: 展开后的字符串列表
         """
-        重定向、替换相关逻辑
-        """
-        if self.tokens:
-            # 管道
-            self.sa.pipe(self.tokens)
-
-        if self.tokens:
-            # 重定向输入
-            self.sa.left_angel(self.tokens)
-
-        if self.tokens:
-            # 标记式重定向输入
-            self.sa.double_left_angel(self.tokens)
-
-        if self.tokens:
-            # 重定向输出，覆盖文件
-            self.sa.right_angel(self.tokens)
-
-        if self.tokens:
-            # 重定向输出，不覆盖
-            self.sa.double_right_angel(self.tokens)
-
-        if self.tokens:
-            # 命令替换
-            self.sa.back_quote(self.tokens)
-
-    def _division(self):
-        """
-        分割语句相关的判断
-        """
-        if self.tokens:
-            # 分号分割语句
-            self.sa.semicolon(self.tokens)
-
-        if self.tokens:
-            # 逻辑与
-            self.sa.double_and(self.tokens)
+        tokens = []
+        for word in words:
+            if isinstance(word, str):
+                tokens.append(word)
+            else:
+                tokens.extend(self.execute(word))
+
+        # 展开shell pid
+        tokens = self.sa.dollars(tokens)
+        # 展开用户目录
+        tokens = self.sa.wave_line(tokens)
+        # 展开变量
+        tokens = self.sa.dollar(tokens)
+
+        return tokens
+
+    def execute(self, node, **flags):
+        """
+        执行语法树中的一个结点
+
+        :param node: 语法树结点
+        :param flags: 后台执行的标志，只传给命令和包裹命令的重定向
+        :return: 执行结果
+        """
+        name = type(node).__name__
+        if name == 'Command':
+            return self._dispatch(node, **flags)
+        elif name == 'Redirect':
+            return getattr(self.sa, node.kind)(node, **flags)
+        elif name in self.symbol_actions:
+            return getattr(self.sa, self.symbol_actions[name])(node)
+        elif name in self.keyword_actions:
+            return getattr(self.ka, self.keyword_actions[name])(node)
+        elif name in ControlFlow.nodes:
+            return ControlFlow.nodes[name].run(self, node)
+        else:
+            raise TypeError('无法执行的语法结点：{}'.format(name))
 
-    def _dispatch(self):
+    def _dispatch(self, node, backend=False, daemon=False, join=False):
         """
         分发命令
+
+        :param backend: 是否在后台执行，只由后台符号传入，不影响其它命令
         """
-        if self.tokens:
-            # 如果没有tokens，说明命令在解析中已经递归执行完毕，直接返回。
-            if self.args:
-                rv = dispatch.dispatch(self.command, *self.args, backend=self.backend, daemon=self.daemon, join=self.join)
-            else:
-                rv = dispatch.dispatch(self.command, backend=self.backend, daemon=self.daemon, join=self.join)
-        else:
-            rv = True
+        tokens = self.expand(node.words)
+        if not tokens:
+            return True
 
-        return rv
+        command, args = tokens[0], tokens[1:]
+        return dispatch.dispatch(command, *args, backend=backend, daemon=daemon, join=join)
 
     def run(self):
         """
-        控制判断符号、关键字的具体逻辑。常在control具体命令中递归执行。
+        执行整棵语法树。常在control具体命令中递归执行。
 
-        :return: None
+        :return: 执行结果
         """
         # 放在这里避免循环导入
         from .control import SymbolAction, KeywordAction
         self.sa = SymbolAction(self)
         self.ka = KeywordAction(self)
 
-        if self.tokens:
-            # exec语句
-            self.ka.exec(self.tokens)
-
-        self._division()
+        if self.tree is None:
+            return False
 
-        self._unfold_literal()
+        try:
+            return self.execute(self.tree)
+        except LoopControl:
+            print('break/continue 只能在循环中使用')
+            return False
 
-        self._backend()
 
-        self._redirect()
+# 以下为辅助函数
 
-        rv = self._dispatch()
+def tokenize(token):
+    """
+    用shlex分割命令
 
-        return rv
+    :param token: 输入的命令
+    :return: 分割后的tokens
+    """
+    # {}是parallel的参数占位符，只有连在一起的{}作为单词的一部分，单独的{和}仍然分割。
+    # 分割前替换为单词字符，分割后再换回来
+    lexer = shlex(token.replace('{}', _placeholder), punctuation_chars=True)
+    lexer.wordchars += '$.\//:' + _placeholder
+    return [word.replace(_placeholder, '{}') for word in lexer]
@@ -48,4 +48,16 @@ class LineEndError(ValueError):
     pass
 
 
+def succeeded(rv):
+    """
+    判断命令是否执行成功。
+    内部命令返回True/False，外部命令返回退出码，退出码为0才算成功。
+    """
+    if isinstance(rv, bool):
+        return rv
+    elif isinstance(rv, int):
+        return rv == 0
+    return bool(rv)
+
+
 getch = _Getch()
@@ -2,13 +2,23 @@
 """
 Dispatch接受解析之后的参数，将参数分发给应用执行，并执行环境需要的其它操作。
 """
+import atexit
+import inspect
 import os
+import signal
+import socket
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Process
 
 from .env import Application, Processing, History, Variable, EnvVariable
-from .middleware import StdinRedirection
+from .middleware import stdio_fds, detach_stdio, local_stdio, decode
+from .jobs import Jobs
+from .pool import WorkerPool
+from .usage import Meter, from_rusage, current
 
 apps = Application.app
 
@@ -25,6 +35,11 @@ class Task(Process):
         self.name = self.app.__class__.__name__
         self.backend = False
         self.is_join = False
+        # 后台执行时是否在独立的进程中，否则在线程池中执行
+        self.isolated = False
+        self._future = None
+        # 结束时记录usage.Usage
+        self.usage = None
 
         if type(self.app) != str:
             # 不是字符串说明是内部注册的命令类
@@ -42,35 +57,32 @@ class Task(Process):
             self._task = None
 
     def run(self):
-        if self.backend:
-            # 如果是后台程序，强制打开输入流
+        if self.isolated:
+            # 如果是独立进程中的后台程序，强制打开输入流
             sys.stdin = os.fdopen(0)
 
             if self._task:
                 Application.app = self._task.env['app']
-                Processing.process = self._task.env['process']
+                Processing.reset(self._task.env['process'])
                 History.history = self._task.env['history']
 
-        if self._task:
-            self._task.env.update(
-                Application=Application,
-                Processing=Processing,
-                History=History,
-                Variable=Variable,
-            )
+        self._bind_env()
 
         Processing.record(self)
+        meter = Meter()
+        spawn = None
 
         try:
             if self._task:
                 # 内部命令，调用注册的方法
                 rv = self._task.handler()
+                if inspect.isgenerator(rv):
+                    # 以生成器方式输出的内部命令
+                    rv = write_lines(rv)
             else:
-                # 外部命令打开子进程
-                rv = subprocess.call([self.app] + [*self.args],
-                                      stdin=sys.stdin,
-                                      stdout=sys.stdout,
-                                      stderr=sys.stderr)
+                # 外部命令交给Spawn直接启动子进程
+                spawn = Spawn(self.app, *self.args)
+                rv = spawn.call()
         except EOFError as e:
             # 多进程可能会发生io错误
             print(e)
@@ -80,10 +92,305 @@ class Task(Process):
             raise
         finally:
             # 清理记录
+            self.usage = spawn.usage if spawn and spawn.usage else meter.stop()
+            Processing.account(self.id, self.usage)
             Processing.remove(self.id)
 
         return rv
 
+    def submit(self, executor):
+        """
+        在线程池中后台执行，与shell共享状态，不需要复制环境。
+        """
+        stdin, stdout = detach_stdio()
+        self._future = executor.submit(self._run_in_thread, stdin, stdout)
+        return self._future
+
+    def _run_in_thread(self, stdin, stdout):
+        try:
+            with local_stdio(stdin, stdout):
+                return self.run()
+        except SystemExit:
+            # 后台命令中的exit只结束它自己
+            return False
+        except Exception as e:
+            print(e)
+            return False
+        finally:
+            for stream in (stdout, stdin):
+                if stream:
+                    try:
+                        stream.close()
+                    except BrokenPipeError:
+                        pass
+
+    def is_alive(self):
+        if self._future:
+            return not self._future.done()
+        return super().is_alive()
+
+    def join(self, timeout=None):
+        if self._future:
+            try:
+                self._future.result(timeout)
+            except Exception:
+                pass
+            return
+        return super().join(timeout)
+
+    def terminate(self):
+        if hasattr(self._future, 'terminate'):
+            # 在进程池中执行
+            return self._future.terminate()
+        if self._future:
+            # 还没有开始执行的可以取消，线程中正在执行的命令无法终止
+            if not self._future.cancel() and not self._future.done():
+                raise RuntimeError('{} 在线程中执行，不能被终止'.format(self.app.__name__))
+            return
+        return super().terminate()
+
+    def stream(self):
+        """
+        以生成器的方式执行内部命令，逐行产生输出而不写入输出流。
+        用于管道中内部命令之间的衔接，下游不再读取时，上游随之停止。
+        """
+        self._bind_env()
+
+        Processing.record(self)
+        # 生成器在下游的线程中恢复执行，只能统计墙上时间
+        meter = Meter(cpu=False)
+        try:
+            rv = yield from lines(self._task.handler())
+        finally:
+            self.usage = meter.stop()
+            Processing.account(self.id, self.usage)
+            Processing.remove(self.id)
+
+        return rv
+
+    def _bind_env(self):
+        if self._task:
+            self._task.env.update(
+                Application=Application,
+                Processing=Processing,
+                History=History,
+                Variable=Variable,
+            )
+
+
+class Spawn:
+    """
+    外部命令。
+    用os.posix_spawn直接启动子进程，不经过multiprocessing再启动一层python进程。
+    argv和环境在创建时就准备好，重定向后的文件描述符作为dup2操作交给posix_spawn。
+    后台执行时子进程就是shell的直接子进程，接口与Task相同，可以记录在Processing中。
+    """
+    # 与subprocess一样，子进程中恢复python忽略的信号，否则管道下游退出时上游不会结束
+    restore_signals = tuple(
+        getattr(signal, name) for name in ('SIGPIPE', 'SIGXFSZ') if hasattr(signal, name)
+    )
+
+    def __init__(self, app, *args):
+        self.app = app
+        self.args = args
+        self.argv = [app] + [*args]
+        self.env = EnvVariable.environ()
+        self._task = None
+        self.backend = False
+        self.is_join = False
+        self.daemon = False
+        self.pid = None
+        self.returncode = None
+        # 子进程被SIGSTOP等信号暂停
+        self.stopped = False
+        # 由wait4得到的usage.Usage
+        self.usage = None
+        # 创建时所在线程中统计子进程的Meter，比如time命令
+        self.meter = current()
+        self.start_time = None
+        self.end_time = None
+        # 前台等待和后台回收可能同时发生，信号处理函数在同一线程中也可以再次获得
+        self._lock = threading.RLock()
+        # posix_spawn需要Python 3.8以上，不可用时（如Windows或更早的版本）退回subprocess
+        self._popen = None
+
+    def _spawn(self):
+        stdin, stdout = stdio_fds()
+        sys.stderr.flush()
+        stderr = sys.stderr.fileno()
+        self.start_time = time.monotonic()
+
+        if not hasattr(os, 'posix_spawn'):
+            self._popen = subprocess.Popen(self.argv, stdin=stdin, stdout=stdout, stderr=stderr,
+                                           env=self.env)
+            self.pid = self._popen.pid
+            return self.pid
+
+        file_actions = [
+            (os.POSIX_SPAWN_DUP2, fd, target)
+            for target, fd in ((0, stdin), (1, stdout), (2, stderr))
+            if fd is not None and fd != target
+        ]
+        self.pid = os.posix_spawn(self.app, self.argv, self.env,
+                                  file_actions=file_actions,
+                                  setsigdef=self.restore_signals)
+        return self.pid
+
+    def _wait(self, block=True):
+        """
+        回收子进程，得到退出码和资源使用情况
+
+        :param block: 是否等待子进程结束
+        :return: 退出码，子进程还没有结束时为None
+        """
+        with self._lock:
+            if self.returncode is not None or self.pid is None:
+                return self.returncode
+
+            if self._popen:
+                self.returncode = self._popen.wait() if block else self._popen.poll()
+                if self.returncode is not None:
+                    self.end_time = time.monotonic()
+                    self.usage = from_rusage(self.end_time - self.start_time, None)
+                return self.returncode
+
+            options = 0 if block else os.WNOHANG | os.WUNTRACED | os.WCONTINUED
+            try:
+                pid, status, rusage = os.wait4(self.pid, options)
+            except ChildProcessError:
+                # 等待时被信号处理函数回收了
+                if self.returncode is None:
+                    self.returncode = -1
+                return self.returncode
+
+            if not pid:
+                return None
+            elif os.WIFSTOPPED(status):
+                self.stopped = True
+            elif os.WIFCONTINUED(status):
+                self.stopped = False
+            else:
+                self.stopped = False
+                self.returncode = _exit_status(status)
+                self.end_time = time.monotonic()
+                self.usage = from_rusage(self.end_time - self.start_time, rusage)
+                if self.meter is not None:
+                    self.meter.report(self.usage)
+            return self.returncode
+
+    def call(self):
+        """
+        启动并等待子进程结束
+
+        :return: 退出码，无法启动时为False
+        """
+        try:
+            self._spawn()
+        except OSError as e:
+            # 文件不能执行，比如没有shebang的脚本
+            print('{}: {}'.format(self.app, e.strerror or e))
+            return False
+
+        try:
+            return self._wait()
+        except KeyboardInterrupt:
+            # 子进程也收到了中断信号，等它退出
+            self._wait()
+            raise
+
+    def run(self):
+        """
+        前台执行
+        """
+        Processing.record(self)
+        try:
+            return self.call()
+        finally:
+            Processing.account(self.id, self.usage)
+            Processing.remove(self.id)
+
+    def start(self):
+        """
+        后台执行，不等待子进程结束
+        """
+        self._spawn()
+        if self.daemon:
+            # 与守护进程相同，shell退出时一同结束
+            atexit.register(self.terminate)
+
+    def is_alive(self):
+        return self.pid is not None and self._wait(block=False) is None
+
+    def poll(self):
+        """
+        不阻塞地检查子进程的状态，供jobs.Jobs在收到SIGCHLD时调用
+        """
+        return self._wait(block=False)
+
+    def join(self):
+        return self._wait()
+
+    def terminate(self):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGTERM)
+
+
+class Group:
+    """
+    作为一个作业在后台执行的复合命令，比如整条管道或者控制语句。
+    在线程池中执行，其中的各个命令按前台方式启动，由这个作业统一等待和报告。
+    """
+
+    def __init__(self, func, command):
+        """
+        :param func: 执行复合命令的函数
+        :param command: 显示用的命令行
+        """
+        self.func = func
+        self.command = command
+        self.backend = True
+        self.pid = None
+        self.usage = None
+        self._future = None
+
+    def submit(self, executor):
+        stdin, stdout = detach_stdio()
+        self._future = executor.submit(self._run, stdin, stdout)
+        return self._future
+
+    def _run(self, stdin, stdout):
+        # 各个命令在不同的线程和子进程中执行，只统计墙上时间
+        meter = Meter(cpu=False)
+        try:
+            with local_stdio(stdin, stdout):
+                return self.func()
+        except SystemExit:
+            return False
+        except Exception as e:
+            print(e)
+            return False
+        finally:
+            self.usage = meter.stop()
+            for stream in (stdout, stdin):
+                if stream:
+                    try:
+                        stream.close()
+                    except BrokenPipeError:
+                        pass
+
+    def is_alive(self):
+        return self._future is not None and not self._future.done()
+
+    def join(self, timeout=None):
+        try:
+            self._future.result(timeout)
+        except Exception:
+            pass
+
+    def terminate(self):
+        if not self._future.cancel() and not self._future.done():
+            raise RuntimeError('{} 在线程中执行，不能被终止'.format(self.command))
+
 
 class Script:
     """
@@ -148,26 +455,23 @@ class Script:
 
     def _parse(self):
         """
-        重定向输入到文件,一行一行解析
-        """
-        from ..contrib.parser import Parser
-
-        tokens = self.lines[1:]
-        si = StdinRedirection(source=tokens)
-        rv = True
-        with si.context():
-            while True:
-                # 虽然是while True，tokens读尽时，上下文管理器弹出StopIteration，捕获后会退出循环
-                token = input()
-                try:
-                    Parser(token).run()
-                except Exception as e:
-                    print(e)
-                    rv = False
-                    break
-        return rv
+        编译脚本为语法树并执行，编译结果缓存到磁盘
+        """
+        from ..contrib.compiler import Compiler
+
+        compiler = Compiler(self.path)
+        program = compiler.compile(self.lines[1:])
+        return compiler.run(program)
 
     def run(self):
+        from ..contrib.compiler import Compiler
+
+        # 脚本没有修改过时，直接执行缓存的语法树
+        compiler = Compiler(self.path)
+        program = compiler.load()
+        if program is not None:
+            return compiler.run(program)
+
         try:
             self._read()
         except Exception as e:
@@ -178,22 +482,76 @@ class Script:
 
 
 class Dispatch:
+    # 后台执行内部命令的线程数
+    max_workers = 8
+    _executor = None
+
     def __init__(self):
         pass
 
+    @classmethod
+    def executor(cls):
+        """
+        后台内部命令使用的线程池，第一次使用时创建
+        """
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(max_workers=cls.max_workers,
+                                               thread_name_prefix='pysh-job')
+        return cls._executor
+
+    @classmethod
+    def new_max_workers(cls, value):
+        """
+        修改线程池的线程数，已经提交的命令在原来的线程池中执行完
+        """
+        value = int(value)
+        if value < 1:
+            raise ValueError('线程数至少为1')
+
+        executor, cls._executor = cls._executor, None
+        cls.max_workers = value
+        if executor is not None:
+            executor.shutdown(wait=False)
+
     def _thread(self, app, *args, daemon=False, join=False):
         """
-        后台命令就新建一个进程。
+        后台命令。
+        内部命令默认在线程池中执行，命令类设置了isolated = True时交给预先启动的工作进程池。
+        外部命令直接作为shell的子进程启动。
 
         :param app: 要启动的app类
         :param args: 命令的参数
         :return: None
         """
-        task = Task(app, *args)
+        task = Spawn(app, *args) if isinstance(app, str) else Task(app, *args)
         task.backend = True
         if join:
             task.is_join = True
 
+        command = ' '.join([os.path.basename(app) if isinstance(app, str) else app.__name__]
+                           + [*args])
+
+        if isinstance(task, Task) and not getattr(app, 'isolated', False):
+            # 线程中的命令由Task.run自己记录
+            task.submit(self.executor())
+            job = Jobs.add(task, command)
+            if join:
+                # 阻塞的命令相当于前台命令，结束后不再作为作业保留
+                Jobs.wait([job.id])
+            return True
+
+        if isinstance(task, Task) and hasattr(socket, 'send_fds'):
+            task._future = WorkerPool.submit(task)
+            Processing.record(task)
+            job = Jobs.add(task, command)
+            if join:
+                # 阻塞的命令相当于前台命令，结束后不再作为作业保留
+                Jobs.wait([job.id])
+            return True
+
+        # 不能传递文件描述符的平台上，每次新建一个进程
+        task.isolated = isinstance(task, Task)
+
         # 守护进程
         # 如果进程以守护进程的方式启动，在父进程结束时，守护进程也立即结束。
         # 并且，以守护进程方式启动，会导致输入混乱。如果以守护进程启动新pysh
@@ -202,6 +560,9 @@ class Dispatch:
 
         try:
             task.start()
+        except OSError as e:
+            print('{}: {}'.format(app, e.strerror or e))
+            return False
         except AssertionError as e:
             # 父进程以守护模式启动，就不能再创建子进程。
             # 会弹出:
@@ -210,13 +571,30 @@ class Dispatch:
             # 总之先忽略它吧……
             print(e)
 
+        # 启动子进程后在父进程也记录子进程的id
+        Processing.record(task)
+        job = Jobs.add(task, command)
+
         # 子进程是否阻塞
         # 在pysh中启动一个新pysh，应该使其阻塞，否则会产生混乱
         if join:
-            task.join()
+            Jobs.wait([job.id])
+        return True
 
-        # 启动子进程后在父进程也记录子进程的id
-        Processing.record(task)
+    def group(self, func, command, join=False):
+        """
+        把复合命令作为一个后台作业执行
+
+        :param func: 执行复合命令的函数
+        :param command: 显示用的命令行
+        :param join: 是否等待作业结束
+        :return: 作业的退出码，不等待时为True
+        """
+        group = Group(func, command)
+        group.submit(self.executor())
+        job = Jobs.add(group, command)
+        if join:
+            return Jobs.wait([job.id])
         return True
 
     def _front(self, app, *args):
@@ -227,7 +605,7 @@ class Dispatch:
         :param args: 命令的参数
         :return: None
         """
-        task = Task(app, *args)
+        task = Spawn(app, *args) if isinstance(app, str) else Task(app, *args)
         return task.run()
 
     def _script(self, file_path):
@@ -236,8 +614,24 @@ class Dispatch:
         """
         return Script(file_path).run()
 
-    @History.history_recorder
-    def dispatch(self, command, *args, backend, daemon, join):
+    def stream(self, command, *args):
+        """
+        如果command是以生成器方式输出的内部命令，返回逐行产生输出的生成器，否则返回None。
+
+        :param command: 命令名
+        :param args: 命令的参数
+        :return: 生成器或None
+        """
+        app = apps.get(command, None)
+        if app is None or not inspect.isgeneratorfunction(getattr(app, 'handler', None)):
+            return None
+
+        return self._stream(command, *args)
+
+    def _stream(self, command, *args):
+        return Task(apps[command], *args).stream()
+
+    def dispatch(self, command, *args, backend=False, daemon=False, join=False):
         # 先搜索注册的应用，没有就搜寻环境PATH变量
         app = apps.get(command, None) or EnvVariable.search_path(command)
 
@@ -258,3 +652,57 @@ class Dispatch:
 
 
 dispatch = Dispatch()
+
+
+# 以下为辅助函数
+
+def lines(records):
+    """
+    把内部命令产生的行或记录转换为以换行结尾的字符串。
+    字节是原始数据，按照middleware.decode解码，写入输出流时还原为原来的字节。
+
+    :param records: 内部命令handler返回的生成器
+    :return: 生成器，结束时返回handler的返回值，没有返回值时为True
+    """
+    try:
+        while True:
+            try:
+                record = next(records)
+            except StopIteration as e:
+                return True if e.value is None else e.value
+
+            if isinstance(record, (bytes, bytearray)):
+                # 字节是原始数据，不再补充换行
+                yield decode(record)
+                continue
+
+            line = record if isinstance(record, str) else str(record)
+            yield line if line.endswith('\n') else line + '\n'
+    finally:
+        records.close()
+
+
+def write_lines(records):
+    """
+    将内部命令产生的行依次写入当前的输出流
+    """
+    generator = lines(records)
+    try:
+        while True:
+            sys.stdout.write(next(generator))
+    except StopIteration as e:
+        return e.value
+    except BrokenPipeError:
+        # 下游已经不再读取
+        generator.close()
+        return False
+
+
+def _exit_status(status):
+    """
+    把wait4得到的状态转换为退出码，被信号终止时为负的信号值。
+    os.waitstatus_to_exitcode需要Python 3.9以上，这里手动解码
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
@@ -2,11 +2,17 @@
 """
 处理shell一切环境信息，包括记录注册的应用以及从外部环境读取变量等
 """
+import atexit
 import os
 import sys
+import threading
+import time
+from bisect import bisect_left, insort
 from collections import deque, OrderedDict
 from datetime import datetime
-from functools import wraps
+from itertools import chain, islice
+
+from .history import HistoryFile
 
 
 class Application:
@@ -34,6 +40,8 @@ class Application:
     def register(self, cls):
         # 将注册的应用收集到app字典中
         app_name = cls.__name__
+        if app_name not in self.app:
+            Symbols.add(app_name)
         self.app[app_name] = cls
 
         return cls
@@ -45,32 +53,89 @@ class Application:
 class Processing:
     """
     记录没有退出的命令的id。
+
+    id由空闲列表分配，释放的id放回列表，下次优先复用，分配和释放都是常数时间。
+    另外按名字和状态建立索引，查找$$、ps和kill不需要遍历整个记录表。
     """
+    ALIVE = 'alive'
+    EXITED = 'exited'
+
     process = {}
+    # 释放的id
+    _free = []
+    # 从未分配过的最小id
+    _next_id = 0
+    # 名字到id的索引，保持记录的先后顺序
+    by_name = {}
+    # 状态到id的索引
+    by_state = {ALIVE: OrderedDict(), EXITED: OrderedDict()}
+    # 最近删除的记录，保留资源使用情况供ps -a查看
+    finished = deque(maxlen=100)
+    # 管道的各个阶段在不同线程中同时记录
+    _lock = threading.RLock()
 
     @classmethod
     def record(cls, task):
         """
         记录命令实例。
         """
-        if not cls.process:
-            task.id = 0
-            pid = task.id
-        else:
-            index = 0
-            while True:
-                if index not in cls.process:
-                    pid = index
-                    break
-                index += 1
-            task.id = pid
-
-        cls.process[pid] = {}
-        cls.process[pid]['NAME'] = task._task.__class__.__name__
-        cls.process[pid]['TIME'] = datetime.now()
-        cls.process[pid]['instance'] = task
+        with cls._lock:
+            return cls._record(task)
+
+    @classmethod
+    def _record(cls, task):
+        pid = cls._allocate()
+        task.id = pid
+
+        # 外部命令没有命令类，记录可执行文件的名字
+        name = task._task.__class__.__name__ if task._task else os.path.basename(task.app)
+        cls.process[pid] = {
+            'NAME': name,
+            'TIME': datetime.now(),
+            'STATE': cls.ALIVE,
+            # 命令结束时记录usage.Usage
+            'USAGE': None,
+            'instance': task,
+        }
+        cls.by_name.setdefault(name, OrderedDict())[pid] = None
+        cls.by_state[cls.ALIVE][pid] = None
         return True
 
+    @classmethod
+    def _allocate(cls):
+        if cls._free:
+            return cls._free.pop()
+
+        pid = cls._next_id
+        cls._next_id += 1
+        return pid
+
+    @classmethod
+    def account(cls, id, usage):
+        """
+        记录命令的资源使用情况
+        """
+        with cls._lock:
+            record = cls.process.get(id)
+            if record is None:
+                return False
+            record['USAGE'] = usage
+            return True
+
+    @classmethod
+    def exit(cls, id):
+        """
+        命令已经结束，但记录暂时保留，比如等待报告退出状态的后台作业
+        """
+        with cls._lock:
+            record = cls.process.get(id)
+            if record is None or record['STATE'] == cls.EXITED:
+                return False
+            record['STATE'] = cls.EXITED
+            cls.by_state[cls.ALIVE].pop(id, None)
+            cls.by_state[cls.EXITED][id] = None
+            return True
+
     @classmethod
     def remove(cls, id):
         """
@@ -79,55 +144,134 @@ class Processing:
         :param id: 命令记录在process字典中的pid值。
         :return: 成功与否。
         """
-        id = id
-        if id in cls.process.keys():
-            cls.process.pop(id)
+        with cls._lock:
+            record = cls.process.pop(id, None)
+            if record is None:
+                return False
+
+            ids = cls.by_name.get(record['NAME'])
+            if ids is not None:
+                ids.pop(id, None)
+                if not ids:
+                    del cls.by_name[record['NAME']]
+            cls.by_state[record['STATE']].pop(id, None)
+            cls._free.append(id)
+            cls.finished.append((id, record))
             return True
-        return False
+
+    @classmethod
+    def find(cls, name):
+        """
+        :param name: 命令名
+        :return: 这个名字的所有记录的id，按记录的先后顺序
+        """
+        return list(cls.by_name.get(name, ()))
+
+    @classmethod
+    def last(cls, name):
+        """
+        :param name: 命令名
+        :return: 这个名字最近的一条记录的id，没有时为None
+        """
+        ids = cls.by_name.get(name)
+        if not ids:
+            return None
+        return next(reversed(ids))
+
+    @classmethod
+    def alive(cls):
+        """
+        :return: 还在执行的命令的id
+        """
+        return list(cls.by_state[cls.ALIVE])
+
+    @classmethod
+    def reset(cls, process=None):
+        """
+        替换全部记录，并重建空闲列表和索引
+
+        :param process: 新的记录，为None时清空
+        """
+        with cls._lock:
+            cls.process = dict(process or {})
+            cls._next_id = max(cls.process, default=-1) + 1
+            cls._free = [pid for pid in range(cls._next_id) if pid not in cls.process][::-1]
+            cls.by_name = {}
+            cls.by_state = {cls.ALIVE: OrderedDict(), cls.EXITED: OrderedDict()}
+            for pid, record in cls.process.items():
+                record.setdefault('STATE', cls.ALIVE)
+                cls.by_name.setdefault(record['NAME'], OrderedDict())[pid] = None
+                cls.by_state[record['STATE']][pid] = None
 
     @classmethod
     def get_records(cls):
         """
-        每次访问，清理掉无效的记录
+        后台命令结束时由jobs.Jobs删除记录，这里不再逐个检查
 
         :return: 记录
         """
-        for id in list(cls.process):
-            try:
-                if cls.process[id]['instance'].backend and not cls.process[id]['instance'].is_alive():
-                    cls.process.pop(id)
-            except AssertionError as e:
-                # 多个pysh进程下，某些情况会弹出这个错误
-                # AssertionError: can only test a child process
-                # 经常在exit的时候弹出
-                # 并不知道这是什么原因……
-                print(e)
-
         return cls.process
 
 
 class History:
     """
     记录命令执行的记录。
+
+    启动时打开history_file_path处的历史文件，之前的命令都可以使用；
+    文件无法打开时退回只在内存中保存的deque。
     """
+    history_file_path = os.path.join(os.path.expanduser('~'), '.pysh_history')
+    default_maxlen = 1000
     history = deque(maxlen=100)
 
     @classmethod
-    def history_recorder(cls, func):
+    def load(cls, path=None):
         """
-        给dispatch.Dispatch.dispatch函数装饰，记录执行的命令。
+        打开历史文件
 
-        :param func: 待装饰的函数
-        :return: 装饰器
+        :param path: 历史文件的路径，默认为history_file_path
+        :return: 是否打开成功
         """
+        try:
+            history = HistoryFile.shared(path or cls.history_file_path, maxlen=cls.default_maxlen)
+        except OSError as e:
+            print('无法打开历史文件：{}'.format(e), file=sys.stderr)
+            return False
 
-        @wraps(func)
-        def decorator(self, command, *args, backend=False, daemon=False, join=False):
-            args = args or []
-            cls.history.append(' '.join([command] + list(args)))
-            return func(self, command, *args, backend=backend, daemon=daemon, join=join)
+        if isinstance(cls.history, HistoryFile) and cls.history is not history:
+            cls.history.close()
+        cls.history = history
+        return True
 
-        return decorator
+    @classmethod
+    def record(cls, line):
+        """
+        记录用户输入的一行命令。只记录顶层输入，循环体、脚本和parallel等执行的命令不记录。
+
+        :param line: 输入的命令
+        :return: None
+        """
+        cls.history.append(line)
+        Symbols.add_history(line)
+
+    @classmethod
+    def search(cls, text, before=None):
+        """
+        从新到旧查找包含text的历史命令
+
+        :param text: 要查找的文字
+        :param before: 只查找序号小于before的命令
+        :return: (序号, 命令)，没有找到时为None
+        """
+        if isinstance(cls.history, HistoryFile):
+            return cls.history.search(text, before)
+
+        history = list(cls.history)
+        end = len(history) if before is None else min(before, len(history))
+        for index in range(end - 1, -1, -1):
+            if text in history[index]:
+                return index, history[index]
+        return None
 
     @classmethod
     def clear(cls):
@@ -137,6 +281,7 @@ class History:
         """
 
         cls.history.clear()
+        Symbols.clear_history()
 
     @classmethod
     def maxlen(cls):
@@ -150,6 +295,11 @@ class History:
         :param value: 可以记录的最大命令数
         :return: None
         """
+        if isinstance(cls.history, HistoryFile):
+            # 文件中保存了全部命令，只需要修改可以看到的数量
+            cls.history.maxlen = int(value)
+            return
+
         new_history = deque(maxlen=int(value))
         new_history.extend(cls.history.copy())
         cls.history = new_history
@@ -163,6 +313,8 @@ class Variable:
 
     @classmethod
     def add(cls, name, value):
+        if name not in cls.variable:
+            Symbols.add(name)
         cls.variable[name] = value
 
     @classmethod
@@ -173,12 +325,109 @@ class Variable:
     def remove(cls, name):
         if cls.variable.get(name) is not None:
             cls.variable.pop(name)
+            Symbols.discard(name)
 
     @classmethod
     def clear(cls):
+        for name in cls.variable:
+            Symbols.discard(name)
         cls.variable.clear()
 
 
+class Symbols:
+    """
+    补全用的名字索引，包括应用名、变量名和最近的历史命令。
+
+    名字保存在有序数组中，以某段文字开头的名字是数组中连续的一段，两次二分查找就能得到全部候选。
+    应用注册、变量赋值和记录历史命令时增量更新。同一个名字可能有多个来源，用引用计数决定何时删除。
+    第一次补全时才读入已有的名字，之前的更新直接忽略。
+    """
+    names = []
+    counts = {}
+    # 索引中的历史命令，超过max_history条时删除最早的
+    history = deque()
+    max_history = 1000
+    _loaded = False
+    _lock = threading.RLock()
+
+    @classmethod
+    def add(cls, name):
+        with cls._lock:
+            if cls._loaded:
+                cls._add(name)
+
+    @classmethod
+    def discard(cls, name):
+        with cls._lock:
+            if cls._loaded:
+                cls._discard(name)
+
+    @classmethod
+    def add_history(cls, line):
+        with cls._lock:
+            if not cls._loaded:
+                return
+            cls.history.append(line)
+            cls._add(line)
+            while len(cls.history) > cls.max_history:
+                cls._discard(cls.history.popleft())
+
+    @classmethod
+    def clear_history(cls):
+        with cls._lock:
+            while cls.history:
+                cls._discard(cls.history.popleft())
+
+    @classmethod
+    def complete(cls, text):
+        """
+        :param text: 已经输入的文字
+        :return: 以text开头的所有名字，按字典序排列
+        """
+        with cls._lock:
+            if not cls._loaded:
+                cls.load()
+            start = bisect_left(cls.names, text)
+            # 以text开头的名字都小于text加上最大的字符
+            end = bisect_left(cls.names, text + chr(0x10ffff), start)
+            return cls.names[start:end]
+
+    @classmethod
+    def load(cls):
+        """
+        从各个来源重新建立索引
+        """
+        with cls._lock:
+            lines = list(islice(reversed(History.history), cls.max_history))
+            lines.reverse()
+            cls.history = deque(lines)
+
+            counts = {}
+            for name in chain(Application.app, Variable.variable, EnvVariable.variable, lines):
+                counts[name] = counts.get(name, 0) + 1
+            cls.counts = counts
+            cls.names = sorted(counts)
+            cls._loaded = True
+
+    @classmethod
+    def _add(cls, name):
+        count = cls.counts.get(name, 0)
+        if not count:
+            insort(cls.names, name)
+        cls.counts[name] = count + 1
+
+    @classmethod
+    def _discard(cls, name):
+        count = cls.counts.get(name, 0)
+        if count > 1:
+            cls.counts[name] = count - 1
+        elif count == 1:
+            del cls.counts[name]
+            index = bisect_left(cls.names, name)
+            if index < len(cls.names) and cls.names[index] == name:
+                del cls.names[index]
+
+
 class EnvVariable:
     """
     环境变量，以及外部PATH变量
@@ -188,42 +437,178 @@ class EnvVariable:
     cached = {}
     PATH = None
 
+    # 文件是只追加的日志，每行一条记录：name=value设置变量，只有name表示删除变量。
+    # 修改先积累在内存中，空闲flush_delay秒、积累max_pending条或者退出时一次写入
+    flush_delay = 1.0
+    max_pending = 128
+    # 日志中的记录超过变量数的compact_ratio倍，并且多于compact_min条时压缩
+    compact_ratio = 2
+    compact_min = 256
+
+    pending = []
+    records = 0
+    # 传给子进程的环境，由os.environ和variable合并，export时增量更新
+    _environ = None
+    _last_write = 0
+    _timer = None
+    _lock = threading.RLock()
+
     @classmethod
     def set_env_variable(cls, name, value):
-        cls.variable.update({name: value})
-        with open(cls.env_file_path, 'wt') as file:
-            for key, value in cls.variable.items():
-                file.write(str(key) + '=' + str(value) + '\n')
+        with cls._lock:
+            if name not in cls.variable:
+                Symbols.add(name)
+            cls.variable.update({name: value})
+            if cls._environ is not None:
+                cls._environ[str(name)] = str(value)
+            cls._append(str(name) + '=' + str(value))
         return True
 
     @classmethod
     def remove_env_variable(cls, name):
-        try:
-            cls.variable.pop(name)
-        except KeyError as e:
-            print(e)
-        else:
-            with open(cls.env_file_path, 'wt') as file:
-                for key, value in cls.variable.items():
-                    file.write(str(key) + '=' + str(value) + '\n')
+        with cls._lock:
+            try:
+                cls.variable.pop(name)
+            except KeyError as e:
+                print(e)
+            else:
+                Symbols.discard(name)
+                if cls._environ is not None:
+                    cls._environ.pop(str(name), None)
+                    if str(name) in os.environ:
+                        cls._environ[str(name)] = os.environ[str(name)]
+                cls._append(str(name))
         return True
 
+    @classmethod
+    def environ(cls):
+        """
+        子进程的环境。只在第一次使用或者失效之后合并一次，之后每次启动子进程直接使用
+
+        :return: 变量名到值的字典
+        """
+        with cls._lock:
+            if cls._environ is None:
+                environ = dict(os.environ)
+                environ.update((str(key), str(value)) for key, value in cls.variable.items())
+                cls._environ = environ
+            return cls._environ
+
+    @classmethod
+    def invalidate(cls):
+        """
+        直接修改os.environ或者variable之后调用，下次使用时重新合并
+        """
+        with cls._lock:
+            cls._environ = None
+
+    @classmethod
+    def _append(cls, record):
+        cls.pending.append(record + '\n')
+        cls._last_write = time.monotonic()
+        if len(cls.pending) >= cls.max_pending:
+            cls.flush()
+        elif cls._timer is None:
+            cls._schedule(cls.flush_delay)
+
+    @classmethod
+    def _schedule(cls, delay):
+        cls._timer = threading.Timer(delay, cls._idle)
+        cls._timer.daemon = True
+        cls._timer.start()
+
+    @classmethod
+    def _idle(cls):
+        with cls._lock:
+            cls._timer = None
+            remain = cls._last_write + cls.flush_delay - time.monotonic()
+            if remain > 0:
+                # 还在连续修改，等到空闲时再写入
+                cls._schedule(remain)
+                return
+            cls.flush()
+
+    @classmethod
+    def flush(cls):
+        """
+        把积累的修改追加到文件，记录过多时压缩文件
+
+        :return: 是否写入成功
+        """
+        with cls._lock:
+            if cls._timer is not None:
+                cls._timer.cancel()
+                cls._timer = None
+            if not cls.pending:
+                return True
+
+            try:
+                if cls.records + len(cls.pending) > \
+                        max(cls.compact_ratio * len(cls.variable), cls.compact_min):
+                    cls.compact()
+                else:
+                    with open(cls.env_file_path, 'at') as file:
+                        file.writelines(cls.pending)
+                    cls.records += len(cls.pending)
+            except OSError as e:
+                print(e, file=sys.stderr)
+                return False
+
+            cls.pending.clear()
+            return True
+
+    @classmethod
+    def compact(cls):
+        """
+        只保留每个变量的当前值，写入临时文件之后原子地替换原文件
+        """
+        with cls._lock:
+            path = cls.env_file_path
+            temp = '{}.{}.tmp'.format(path, os.getpid())
+            try:
+                with open(temp, 'wt') as file:
+                    for key, value in cls.variable.items():
+                        file.write(str(key) + '=' + str(value) + '\n')
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp, path)
+            except OSError:
+                if os.path.exists(temp):
+                    os.remove(temp)
+                raise
+
+            cls.records = len(cls.variable)
+            cls.pending.clear()
+
     @classmethod
     def search_path(cls, name):
-        if name in cls.cached:
-            return cls.cached[name]
+        """
+        在PATH中查找外部命令。
 
-        for dir in cls.PATH:
-            path = os.path.join(dir, name)
-            if os.path.isfile(path):
-                cls.cached_path(name, path)
-                return path
-            path = os.path.join(dir, name + '.exe')
-            if os.path.isfile(path):
-                cls.cached_path(name, path)
-                return path
-        else:
-            return False
+        普通的命令名直接在索引中查找。带路径分隔符的名字无法使用索引，
+        需要逐个目录检查文件。
+
+        :param name: 命令名
+        :return: 命令的路径，没有找到时为False
+        """
+        if os.sep in name or (os.altsep and os.altsep in name):
+            return cls._search_file(name)
+
+        path = PathIndex.lookup(name)
+        if path:
+            cls.cached[name] = path
+            return path
+        return False
+
+    @classmethod
+    def _search_file(cls, name):
+        # 路径可能随时被创建，不记入失败缓存
+        dirs = [''] if os.path.isabs(name) else cls.PATH
+        for dir in dirs:
+            for path in (os.path.join(dir, name), os.path.join(dir, name + '.exe')):
+                if os.path.isfile(path):
+                    return path
+        return False
 
     @classmethod
     def cached_path(cls, name, path):
@@ -233,11 +618,171 @@ class EnvVariable:
     @classmethod
     def clear_cached(cls):
         cls.cached.clear()
+        PathIndex.clear()
         return True
 
 
+class PathIndex:
+    """
+    PATH中所有命令的索引。
+
+    每个目录用os.scandir扫描一次，保存名字到路径的字典，再按PATH的顺序合并为一个索引，
+    查找命令只需要一次字典查找。目录的修改时间改变时才重新扫描这个目录。
+    为了不在每次查找时检查所有目录，至少间隔interval秒才检查一次；
+    没有找到命令时会立即检查，刚安装的命令也能找到，而失败缓存避免反复检查同一个找不到的名字。
+    """
+    # 两次检查目录修改时间的最小间隔，单位秒
+    interval = 1.0
+    # 失败缓存的最大数量
+    max_misses = 256
+
+    # 目录到(修改时间, {名字: 路径})的字典
+    dirs = {}
+    index = {}
+    # 找不到的名字，按最近使用的顺序
+    misses = OrderedDict()
+    _path = None
+    _checked = None
+    _lock = threading.RLock()
+
+    hits = 0
+    miss_count = 0
+    negative_hits = 0
+    scans = 0
+
+    @classmethod
+    def lookup(cls, name):
+        with cls._lock:
+            if cls._checked is None or time.monotonic() - cls._checked > cls.interval:
+                cls.revalidate()
+
+            path = cls.index.get(name)
+            if path:
+                cls.hits += 1
+                return path
+
+            if cls.missed(name):
+                return False
+
+            # 可能是刚刚安装的命令，立即检查一次
+            if cls.revalidate(force=False):
+                path = cls.index.get(name)
+                if path:
+                    cls.hits += 1
+                    return path
+
+            cls.miss(name)
+            return False
+
+    @classmethod
+    def missed(cls, name):
+        """
+        查找失败缓存。缓存在任何目录修改之后失效
+        """
+        with cls._lock:
+            if name in cls.misses:
+                cls.misses.move_to_end(name)
+                cls.negative_hits += 1
+                return True
+            return False
+
+    @classmethod
+    def miss(cls, name):
+        with cls._lock:
+            cls.miss_count += 1
+            cls.misses[name] = None
+            while len(cls.misses) > cls.max_misses:
+                cls.misses.popitem(last=False)
+
+    @classmethod
+    def revalidate(cls, force=False):
+        """
+        检查PATH中各个目录的修改时间，重新扫描修改过的目录
+
+        :param force: 是否不管修改时间，重新扫描所有目录
+        :return: 索引是否改变
+        """
+        with cls._lock:
+            cls._checked = time.monotonic()
+            path = tuple(EnvVariable.PATH or ())
+            changed = force or path != cls._path
+
+            dirs = {}
+            for dir in path:
+                if dir in dirs:
+                    continue
+                try:
+                    mtime = os.stat(dir).st_mtime_ns
+                except OSError:
+                    mtime = None
+
+                entry = cls.dirs.get(dir)
+                if not force and entry is not None and entry[0] == mtime:
+                    dirs[dir] = entry
+                else:
+                    dirs[dir] = (mtime, _scan(dir) if mtime is not None else {})
+                    changed = True
+
+            if changed:
+                cls.dirs = dirs
+                cls._path = path
+                index = {}
+                # PATH中靠前的目录优先
+                for dir in reversed(path):
+                    index.update(dirs[dir][1])
+                cls.index = index
+                cls.misses.clear()
+            return changed
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls.dirs = {}
+            cls.index = {}
+            cls.misses.clear()
+            cls._path = None
+            cls._checked = None
+
+    @classmethod
+    def info(cls):
+        with cls._lock:
+            return OrderedDict([
+                ('dirs', len(cls.dirs)),
+                ('commands', len(cls.index)),
+                ('scans', cls.scans),
+                ('hits', cls.hits),
+                ('misses', cls.miss_count),
+                ('negative', len(cls.misses)),
+                ('negative_hits', cls.negative_hits),
+            ])
+
+
 # 以下辅助函数
 
+def _scan(dir):
+    """
+    扫描一个目录中的文件
+
+    :return: 名字到路径的字典，.exe文件同时记录去掉后缀的名字
+    """
+    PathIndex.scans += 1
+    names = {}
+    try:
+        with os.scandir(dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                names[entry.name] = entry.path
+                if entry.name.endswith('.exe'):
+                    names.setdefault(entry.name[:-4], entry.path)
+    except OSError:
+        pass
+    return names
+
+
 def get_env_path():
     PATH = os.environ['PATH']
     sep = ';' if sys.platform == 'win32' else ':'
@@ -245,27 +790,32 @@ def get_env_path():
 
 def get_env_variable(EnvVariable):
     """
-    从文件中读取环境变量。
+    从文件中读取环境变量。按顺序重放日志中的每条记录，同时统计记录数。
 
     :param EnvVariable: EnvVariable类
     :return: 读取的变量名和值的字典
     """
     path = EnvVariable.env_file_path
+    variable = OrderedDict()
+    records = 0
     try:
         with open(path, 'rt') as file:
-            lines = file.readlines()
-            variable = {}
-            for line in lines:
-                try:
-                    name, value = line.strip().split('=')
-                    name, value = name.strip(), value.strip()
-                except Exception:
-                    pass
-                else:
-                    variable.update({name: value})
-    except FileNotFoundError as e:
-        variable = {}
-        pass
+            data = file.read()
+    except FileNotFoundError:
+        data = ''
+
+    for line in data.splitlines():
+        name, sep, value = line.partition('=')
+        name = name.strip()
+        if not name:
+            continue
+        records += 1
+        if sep:
+            variable[name] = value.strip()
+        else:
+            variable.pop(name, None)
+
+    EnvVariable.records = records
     return variable
 
 
@@ -273,4 +823,10 @@ if not EnvVariable.variable:
     EnvVariable.variable = get_env_variable(EnvVariable)
 
 if not EnvVariable.PATH:
-    EnvVariable.PATH = get_env_path()
\ No newline at end of file
+    EnvVariable.PATH = get_env_path()
+
+if not isinstance(History.history, HistoryFile):
+    History.load()
+
+# 退出时写入还没有保存的环境变量
+atexit.register(EnvVariable.flush)
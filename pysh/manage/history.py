@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+保存在磁盘上的历史命令。
+
+历史命令只追加写入日志文件，每条命令一行，命令中的换行和反斜杠被转义。
+另一个索引文件按顺序保存每条命令在日志中的偏移，每条8字节。
+两个文件都通过mmap读取，启动时不需要读入整个文件，按序号读取任意一条命令只需要查一次索引。
+
+搜索包含某段文字的命令时使用三元组索引：每三个连续字符对应包含它的命令序号的有序数组。
+索引在第一次搜索时建立，之后随追加的命令更新。
+
+多个pysh进程共用同一个历史文件。追加时对日志加排它锁，先读取文件的当前长度再写入，
+不会互相覆盖；读取前在共享锁下检查两个文件的长度，就能看到其它进程追加的命令，不需要重新读取文件。
+"""
+import contextlib
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 索引中的偏移是小端的无符号64位整数
+_offset = struct.Struct('<Q')
+# 遍历时每次在锁中读取的命令数
+_batch = 256
+# 文件固定用utf-8编码，无法解码的字节原样保存
+_encoding = 'utf-8'
+_errors = 'surrogateescape'
+
+
+class HistoryFile:
+    """
+    接口与deque相同的历史命令。只能看到最近maxlen条命令，修改maxlen不需要复制数据
+    """
+    # 路径到已经打开的实例，同一个进程中的多份状态共用一个实例
+    instances = {}
+
+    @classmethod
+    def shared(cls, path, maxlen=None):
+        """
+        打开历史文件，已经打开过时返回原来的实例
+
+        :param path: 日志文件的路径
+        :param maxlen: 可以看到的最大命令数
+        :return: HistoryFile
+        """
+        history = cls.instances.get(path)
+        if history is None or history._log is None:
+            history = cls.instances[path] = cls(path, maxlen)
+        else:
+            history.maxlen = maxlen
+        return history
+
+    def __init__(self, path, maxlen=None):
+        """
+        :param path: 日志文件的路径，索引文件为path加上.idx
+        :param maxlen: 可以看到的最大命令数，None为不限制
+        """
+        self.path = path
+        self.index_path = path + '.idx'
+        self.maxlen = maxlen
+        self._lock = threading.RLock()
+        self._log = None
+        self._index = None
+        self._pid = None
+        # 日志和索引的mmap，文件增长之后在读取时重新映射
+        self._log_map = None
+        self._index_map = None
+        self._count = 0
+        self._size = 0
+        # 三元组到命令序号数组的字典，None表示还没有建立
+        self._grams = None
+        self._indexed = 0
+        self._open()
+
+    def append(self, command):
+        record = _escape(command)
+        with self._lock, self._flock(True):
+            # 其它进程可能已经追加过命令，从文件的当前长度开始写入
+            self._refresh()
+            self._repair()
+            os.write(self._log, record)
+            os.write(self._index, _offset.pack(self._size))
+            self._size += len(record)
+            self._count += 1
+            if self._grams is not None:
+                self._update_index()
+
+    def pop(self):
+        """
+        删除最后一条命令
+
+        :return: 删除的命令
+        """
+        with self._lock, self._flock(True):
+            self._refresh()
+            if not self._count:
+                raise IndexError('pop from an empty history')
+            command = self._read(self._count - 1)
+            self._count -= 1
+            self._size = self._offset(self._count)
+            self._truncate()
+            self._grams = None
+            return command
+
+    def clear(self):
+        with self._lock, self._flock(True):
+            self._count = self._size = 0
+            self._truncate()
+            self._grams = None
+
+    def search(self, text, before=None):
+        """
+        从新到旧查找包含text的命令，与遍历一样只查找最近maxlen条命令
+
+        :param text: 要查找的文字
+        :param before: 只查找序号小于before的命令，用于继续查找更早的命令。序号是命令在文件中的位置
+        :return: (序号, 命令)，没有找到时为None
+        """
+        # 查找期间持有共享锁，其它进程不能截断正在读取的文件
+        with self._lock, self._flock():
+            self._refresh()
+            end = self._count if before is None else min(before, self._count)
+            # 超出maxlen的命令看不到
+            start = self._count - self._length()
+            if len(text) < 3:
+                # 太短的文字没有三元组，从新到旧逐条查找
+                for position in range(end - 1, start - 1, -1):
+                    command = self._read(position)
+                    if text in command:
+                        return position, command
+                return None
+
+            self._update_index()
+            postings = []
+            for gram in _trigrams(text):
+                positions = self._grams.get(gram)
+                if positions is None:
+                    return None
+                postings.append(positions)
+
+            # 从最短的数组开始，其余数组用二分查找确认
+            postings.sort(key=len)
+            first, others = postings[0], postings[1:]
+            for index in range(bisect_left(first, end) - 1, bisect_left(first, start) - 1, -1):
+                position = first[index]
+                if not all(_includes(positions, position) for positions in others):
+                    continue
+                # 三元组都出现不代表连续出现，还要检查命令本身
+                command = self._read(position)
+                if text in command:
+                    return position, command
+            return None
+
+    def copy(self):
+        return list(self)
+
+    def total(self):
+        """
+        :return: 文件中保存的全部命令数，不受maxlen限制
+        """
+        with self._lock:
+            self._sync()
+            return self._count
+
+    def __len__(self):
+        with self._lock:
+            self._sync()
+            return self._length()
+
+    def __getitem__(self, index):
+        with self._lock, self._flock():
+            self._refresh()
+            length = self._length()
+            if index < 0:
+                index += length
+            if not 0 <= index < length:
+                raise IndexError('history index out of range')
+            return self._read(self._count - length + index)
+
+    def __iter__(self):
+        with self._lock:
+            self._sync()
+            count, length = self._count, self._length()
+        return self._batches(range(count - length, count))
+
+    def __reversed__(self):
+        with self._lock:
+            self._sync()
+            count, length = self._count, self._length()
+        return self._batches(range(count - 1, count - length - 1, -1))
+
+    def __reduce__(self):
+        # 在子进程中打开同一个文件，多次传入时共用一个实例
+        return _shared, (self.path, self.maxlen)
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+            for fd in (self._log, self._index):
+                if fd is not None:
+                    os.close(fd)
+            self._log = self._index = None
+
+    def _open(self):
+        flags = os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, 'O_CLOEXEC', 0)
+        self._pid = os.getpid()
+        self._log = os.open(self.path, flags, 0o600)
+        self._index = os.open(self.index_path, flags, 0o600)
+        with self._flock(True):
+            self._refresh()
+            self._repair()
+
+    @contextlib.contextmanager
+    def _flock(self, exclusive=False):
+        """
+        对日志文件加锁。没有fcntl的平台上只有线程锁
+        """
+        if self._pid != os.getpid():
+            # fork得到的子进程与父进程共用打开的文件，flock互相不排斥，需要重新打开
+            self.close()
+            self._open()
+
+        if fcntl is None:
+            yield
+            return
+
+        fcntl.flock(self._log, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._log, fcntl.LOCK_UN)
+
+    def _length(self):
+        if self.maxlen is None:
+            return self._count
+        return min(self._count, self.maxlen)
+
+    def _batches(self, positions):
+        """
+        分批读取命令。每批在共享锁中读取，其它进程不能在读取时截断文件，
+        否则读取mmap中文件末尾之后的部分会收到SIGBUS。批与批之间文件变短时跳过已经删除的命令
+        """
+        for start in range(0, len(positions), _batch):
+            with self._lock, self._flock():
+                self._refresh()
+                commands = [self._read(position) for position in positions[start:start + _batch]
+                            if position < self._count]
+            yield from commands
+
+    def _sync(self):
+        """
+        在共享锁中读取文件长度，其它进程的追加要么全部可见要么全部不可见
+        """
+        with self._flock():
+            self._refresh()
+
+    def _refresh(self):
+        """
+        读取两个文件的当前长度。文件变短说明被其它进程清空或删除过命令，丢弃三元组索引
+        """
+        size = os.fstat(self._log).st_size
+        count = os.fstat(self._index).st_size // _offset.size
+
+        if count < self._count or size < self._size:
+            self._grams = None
+            self._unmap()
+        self._size, self._count = size, count
+
+    def _repair(self):
+        """
+        写入日志之后、写入索引之前退出的进程会留下没有索引的命令，两个文件也可能被分别修改过。
+        丢弃指向日志之外的索引，再从最后一条有效的索引开始扫描日志，补上缺少的索引。
+        需要在排它锁中调用，通常只读取最后一条命令
+        """
+        count = self._count
+        while count and _pread_offset(self._index, count - 1) >= self._size:
+            count -= 1
+
+        position = _pread_offset(self._index, count - 1) if count else 0
+        tail = os.pread(self._log, self._size - position, position)
+        if tail and not tail.endswith(b'\n'):
+            # 最后一条命令没有写完整，补上换行，避免和之后追加的命令连在一起
+            os.write(self._log, b'\n')
+            tail += b'\n'
+            self._size += 1
+
+        offsets = []
+        start = 0
+        while start < len(tail):
+            offsets.append(position + start)
+            start = tail.index(b'\n', start) + 1
+        if count:
+            # 第一条是已经有索引的命令
+            offsets = offsets[1:]
+
+        if count == self._count and not offsets:
+            return
+
+        os.ftruncate(self._index, count * _offset.size)
+        os.write(self._index, b''.join(_offset.pack(offset) for offset in offsets))
+        self._count = count + len(offsets)
+        self._grams = None
+        self._unmap()
+
+    def _update_index(self):
+        if self._grams is None:
+            self._grams = {}
+            self._indexed = 0
+        if self._indexed >= self._count:
+            return
+
+        # 一次解码所有还没有索引的命令，不逐条读取
+        start = self._offset(self._indexed)
+        if self._size > len(self._log_map or b''):
+            self._remap()
+        records = bytes(self._log_map[start:self._size]).decode(_encoding, _errors)
+        grams = self._grams
+        for position, record in enumerate(records.split('\n'), self._indexed):
+            if position >= self._count:
+                break
+            if '\\' in record:
+                record = _unescape(record)
+            for gram in {record[index:index + 3] for index in range(len(record) - 2)}:
+                positions = grams.get(gram)
+                if positions is None:
+                    positions = grams[gram] = array('I')
+                positions.append(position)
+        self._indexed = self._count
+
+    def _read(self, position):
+        start = self._offset(position)
+        end = self._offset(position + 1) if position + 1 < self._count else self._size
+        if end > len(self._log_map or b''):
+            self._remap()
+        return _unescape(bytes(self._log_map[start:end]).decode(_encoding, _errors))
+
+    def _offset(self, position):
+        if (position + 1) * _offset.size > len(self._index_map or b''):
+            self._remap()
+        return _offset.unpack_from(self._index_map, position * _offset.size)[0]
+
+    def _remap(self):
+        self._unmap()
+        self._log_map = _map(self._log, self._size)
+        self._index_map = _map(self._index, self._count * _offset.size)
+
+    def _unmap(self):
+        for current in (self._log_map, self._index_map):
+            if current is not None:
+                current.close()
+        self._log_map = self._index_map = None
+
+    def _truncate(self):
+        self._unmap()
+        os.ftruncate(self._log, self._size)
+        os.ftruncate(self._index, self._count * _offset.size)
+
+
+# 以下为辅助函数
+
+def _map(fd, size):
+    # 空文件不能映射
+    if not size:
+        return None
+    return mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+
+
+def _trigrams(text):
+    return (text[index:index + 3] for index in range(len(text) - 2))
+
+
+def _includes(positions, position):
+    index = bisect_left(positions, position)
+    return index < len(positions) and positions[index] == position
+
+
+def _shared(path, maxlen):
+    return HistoryFile.shared(path, maxlen)
+
+
+def _pread_offset(fd, position):
+    return _offset.unpack(os.pread(fd, _offset.size, position * _offset.size))[0]
+
+
+def _escape(command):
+    command = command.replace('\\', '\\\\').replace('\n', '\\n')
+    return (command + '\n').encode(_encoding, _errors)
+
+
+def _unescape(command):
+    if command.endswith('\n'):
+        command = command[:-1]
+    if '\\' not in command:
+        return command
+
+    chars = []
+    escaped = False
+    for char in command:
+        if escaped:
+            chars.append('\n' if char == 'n' else char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        else:
+            chars.append(char)
+    return ''.join(chars)
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+后台命令的作业控制。
+
+外部命令是shell的子进程，收到SIGCHLD时立即回收，得到退出码和资源使用情况；
+线程池和进程池中的命令在Future完成时回调。作业结束后记录保留到被jobs显示或被wait取走，
+等待作业的命令在条件变量上等待通知，不需要轮询。
+"""
+import os
+import signal
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from .env import Processing
+from .usage import Usage
+
+
+class Job:
+    """
+    一个后台作业
+    """
+    RUNNING = 'Running'
+    STOPPED = 'Stopped'
+    DONE = 'Done'
+
+    def __init__(self, id, command, instance):
+        self.id = id
+        self.command = command
+        self.instance = instance
+        self.state = self.RUNNING
+        self.returncode = None
+        # 结束时记录usage.Usage
+        self.usage = None
+        self.start_time = time.monotonic()
+        self.started_at = datetime.now()
+        self.end_time = None
+
+    @property
+    def pid(self):
+        return getattr(self.instance, 'pid', None)
+
+    @property
+    def wall_time(self):
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    def status(self):
+        if self.state == self.DONE:
+            return 'Done' if self.returncode == 0 else 'Exit {}'.format(self.returncode)
+        return self.state
+
+
+class Jobs:
+    jobs = OrderedDict()
+    _next_id = 1
+    # 信号处理函数和结束回调都可能在持有锁的线程中再次获得锁
+    _condition = threading.Condition(threading.RLock())
+    _installed = False
+
+    @classmethod
+    def add(cls, instance, command):
+        """
+        记录一个刚启动的后台命令。
+
+        :param instance: dispatch.Task或dispatch.Spawn实例
+        :param command: 显示用的命令行
+        :return: Job
+        """
+        with cls._condition:
+            if not cls.jobs:
+                # 和bash一样，没有作业时作业号从1重新开始
+                cls._next_id = 1
+            job = Job(cls._next_id, command, instance)
+            cls._next_id += 1
+            cls.jobs[job.id] = job
+
+        future = getattr(instance, '_future', None)
+        if future is not None:
+            future.add_done_callback(lambda future: cls._finish_future(job, future))
+        else:
+            cls._install()
+            # 可能在记录之前就已经结束了
+            cls.reap()
+        return job
+
+    @classmethod
+    def get(cls, id):
+        """
+        :param id: 作业号，可以写作%1或1
+        :return: Job，不存在时为None
+        """
+        try:
+            return cls.jobs.get(int(str(id).lstrip('%')))
+        except ValueError:
+            return None
+
+    @classmethod
+    def reap(cls):
+        """
+        检查还在执行的子进程，回收已经结束的
+        """
+        with cls._condition:
+            changed = False
+            for job in list(cls.jobs.values()):
+                if job.state == Job.DONE or getattr(job.instance, '_future', None) is not None:
+                    continue
+
+                instance = job.instance
+                alive = instance.is_alive()
+                stopped = getattr(instance, 'stopped', False)
+                state = Job.STOPPED if alive and stopped else Job.RUNNING if alive else Job.DONE
+                if state == job.state:
+                    continue
+
+                changed = True
+                if state == Job.DONE:
+                    returncode = getattr(instance, 'returncode', None)
+                    if returncode is None:
+                        # multiprocessing.Process
+                        returncode = getattr(instance, 'exitcode', None)
+                    cls._finish(job, returncode, getattr(instance, 'usage', None))
+                else:
+                    job.state = state
+
+            if changed:
+                cls._condition.notify_all()
+
+    @classmethod
+    def wait(cls, ids=None, stop=False):
+        """
+        等待作业结束，不需要轮询
+
+        :param ids: 作业号列表，为None时等待所有作业
+        :param stop: 作业暂停时是否也返回，供fg使用
+        :return: 最后一个作业的退出码
+        """
+        with cls._condition:
+            jobs = [cls.jobs[id] for id in ids if id in cls.jobs] if ids is not None \
+                else list(cls.jobs.values())
+
+            def pending():
+                return [job for job in jobs
+                        if job.state == Job.RUNNING or (job.state == Job.STOPPED and not stop)]
+
+            while pending():
+                # SIGCHLD在检查之后、等待之前到达时不会唤醒这里，所以超时后再检查一次。
+                # 没有安装信号处理函数时（不在主线程中），只能定时检查
+                if not cls._condition.wait(1 if cls._installed else 0.1):
+                    cls.reap()
+
+            for job in jobs:
+                if job.state == Job.DONE:
+                    cls._forget(job)
+
+            return jobs[-1].returncode if jobs else 0
+
+    @classmethod
+    def resume(cls, job):
+        """
+        让暂停的作业继续执行
+        """
+        if job.state != Job.STOPPED or not job.pid:
+            return False
+
+        os.kill(job.pid, signal.SIGCONT)
+        with cls._condition:
+            job.state = Job.RUNNING
+            job.instance.stopped = False
+        return True
+
+    @classmethod
+    def notify(cls):
+        """
+        取出结束了但是还没有报告的作业，报告后不再保留
+        """
+        with cls._condition:
+            done = [job for job in cls.jobs.values() if job.state == Job.DONE]
+            for job in done:
+                cls._forget(job)
+            return done
+
+    @classmethod
+    def _install(cls):
+        """
+        安装SIGCHLD的处理函数。只有主线程可以安装，其它线程中只能定时检查
+        """
+        if cls._installed:
+            return
+
+        try:
+            previous = signal.getsignal(signal.SIGCHLD)
+
+            def handler(signum, frame):
+                cls.reap()
+                if callable(previous):
+                    previous(signum, frame)
+
+            signal.signal(signal.SIGCHLD, handler)
+        except (ValueError, AttributeError):
+            # 不在主线程中，或者平台没有SIGCHLD
+            return
+        cls._installed = True
+
+    @classmethod
+    def _finish_future(cls, job, future):
+        if future.cancelled():
+            rv = False
+        else:
+            try:
+                rv = future.result()
+            except Exception:
+                rv = False
+
+        # 线程中的命令由Task记录，进程池中的命令由Job带回
+        usage = getattr(future, 'usage', None) or getattr(job.instance, 'usage', None)
+        with cls._condition:
+            cls._finish(job, _exit_code(rv), usage)
+            cls._condition.notify_all()
+
+    @classmethod
+    def _finish(cls, job, returncode, usage):
+        job.state = Job.DONE
+        job.returncode = returncode
+        job.end_time = time.monotonic()
+        job.usage = usage or Usage(job.wall_time, None, None, None)
+        # 记录保留到作业被报告或等待之后
+        if _recorded(job):
+            Processing.account(job.instance.id, job.usage)
+            Processing.exit(job.instance.id)
+
+    @classmethod
+    def _forget(cls, job):
+        cls.jobs.pop(job.id, None)
+        if _recorded(job):
+            Processing.remove(job.instance.id)
+
+
+# 以下为辅助函数
+
+def _recorded(job):
+    """
+    作业的命令是否还记录在Processing中。线程中的命令结束时自己删除记录，id可能已经被复用
+    """
+    instance_id = getattr(job.instance, 'id', None)
+    record = Processing.process.get(instance_id)
+    return record is not None and record['instance'] is job.instance
+
+
+def _exit_code(rv):
+    """
+    把内部命令的返回值转换为退出码
+    """
+    if rv is None or rv is True:
+        return 0
+    elif rv is False:
+        return 1
+    elif isinstance(rv, int):
+        return rv
+    return 0 if rv else 1
@@ -1,11 +1,340 @@
 # -*- coding: utf-8 -*-
+import atexit
+import codecs
 import contextlib
-import itertools
+import inspect
+import io
+import locale
 import os
+import select
+import shutil
 import sys
-from itertools import chain
+import tempfile
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 
-from ..manage.env import Application, Variable, EnvVariable, History
+from ..manage.env import Symbols
+
+# 内部命令读写文本时统一使用的编码。
+# 无法解码的字节用surrogateescape保留在字符串中，再编码时还原为原来的字节，
+# 二进制数据经过内部命令、命令替代也不会损坏
+ENCODING = locale.getpreferredencoding(False)
+ERRORS = 'surrogateescape'
+
+
+class LocalStream:
+    """
+    按线程区分的标准输入输出流。
+    管道的各个阶段在不同线程中同时执行，每个线程需要有自己的输入输出流，
+    所以sys.stdin和sys.stdout替换为这个代理，再由它转发给当前线程设置的流。
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._local = threading.local()
+
+    @property
+    def stream(self):
+        return getattr(self._local, 'stream', None) or self.default
+
+    def set(self, stream):
+        """
+        设置当前线程的流
+
+        :param stream: 新的流，为None时恢复为默认流
+        :return: 原来的流
+        """
+        origin = getattr(self._local, 'stream', None)
+        self._local.stream = stream
+        return origin
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        return iter(self.stream)
+
+    def __next__(self):
+        return next(self.stream)
+
+
+def swap_stdout(stream):
+    """
+    替换当前线程的输出流。
+
+    :param stream: 新的输出流，为None时恢复为默认流
+    :return: 原来的输出流，用于之后还原
+    """
+    if isinstance(sys.stdout, LocalStream):
+        return sys.stdout.set(stream)
+
+    origin = sys.stdout
+    sys.stdout = stream or sys.__stdout__
+    return origin
+
+
+def swap_stdin(stream):
+    """
+    替换当前线程的输入流，与swap_stdout相同
+    """
+    if isinstance(sys.stdin, LocalStream):
+        return sys.stdin.set(stream)
+
+    origin = sys.stdin
+    sys.stdin = stream or sys.__stdin__
+    return origin
+
+
+def current_stdin():
+    """
+    当前线程实际使用的输入流
+    """
+    if isinstance(sys.stdin, LocalStream):
+        return sys.stdin.stream
+    return sys.stdin
+
+
+def current_stdout():
+    """
+    当前线程实际使用的输出流
+    """
+    if isinstance(sys.stdout, LocalStream):
+        return sys.stdout.stream
+    return sys.stdout
+
+
+def stdio_fds():
+    """
+    把当前线程的输入输出流解析为文件描述符，交给外部命令。
+    外部命令直接读写这些文件描述符，重定向的文件、管道中的数据都不经过python。
+    解析前先刷新python层面的缓冲，保证内部命令和外部命令输出的顺序。
+
+    :return: (stdin, stdout)，流没有文件描述符时为None，外部命令将继承shell本身的输入输出
+    """
+    fds = []
+    for stream in (current_stdin(), current_stdout()):
+        try:
+            if stream.writable():
+                stream.flush()
+            fds.append(stream.fileno())
+        except (AttributeError, ValueError, OSError):
+            # io.UnsupportedOperation也是OSError和ValueError的子类
+            fds.append(None)
+
+    return tuple(fds)
+
+
+def open_stream(file, mode='r', closefd=True):
+    """
+    以二进制方式打开文件或文件描述符，再包装为文本流。
+    外部命令通过fileno直接读写下面的字节，数据不经过解码；
+    内部命令读写文本时在这里解码，只按\n分行，\r等换行符原样保留。
+
+    :param file: 文件路径或文件描述符
+    :param mode: 'r'、'w'或'a'
+    :return: 文本流，字节流在它的buffer属性中
+    """
+    binary = open(file, mode.replace('t', '').replace('b', '') + 'b', closefd=closefd)
+    return io.TextIOWrapper(binary, encoding=ENCODING, errors=ERRORS, newline='\n')
+
+
+def decode(data):
+    """
+    把字节解码为内部命令使用的文本
+    """
+    return bytes(data).decode(ENCODING, ERRORS)
+
+
+def encode(text):
+    """
+    把内部命令的文本还原为字节
+    """
+    return text.encode(ENCODING, ERRORS)
+
+
+def detach_stdio():
+    """
+    复制当前线程中被重定向的输入输出流，交给后台线程中的命令独占使用。
+    前台的重定向结束、关闭了原来的流以后，后台命令仍然可以继续读写。
+
+    :return: (stdin, stdout)，没有被重定向的流为None，后台命令使用默认的流
+    """
+    streams = []
+    for stream, fd, mode in zip((sys.stdin, sys.stdout), stdio_fds(), ('r', 'w')):
+        default = stream.default if isinstance(stream, LocalStream) else None
+        if fd is None or default is None or fd == _fileno(default):
+            streams.append(None)
+        else:
+            streams.append(open_stream(os.dup(fd), mode))
+
+    return tuple(streams)
+
+
+@contextlib.contextmanager
+def local_stdio(stdin=None, stdout=None):
+    """
+    在当前线程内临时替换输入输出流，供管道的各个阶段使用
+    """
+    origin_stdin = swap_stdin(stdin) if stdin else None
+    origin_stdout = swap_stdout(stdout) if stdout else None
+    try:
+        yield
+    finally:
+        if stdout:
+            swap_stdout(origin_stdout)
+        if stdin:
+            swap_stdin(origin_stdin)
+
+
+class _Spool:
+    """
+    先保存在内存中的字节缓冲区，超过max_size后转存到私有临时目录中的文件。
+    第一次转存时才创建临时目录，输出较小时不会创建目录
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._file = io.BytesIO()
+        self.rolled = False
+
+    def write(self, data):
+        if not self.rolled and self._file.tell() + len(data) > self.max_size:
+            self.rollover()
+        return self._file.write(data)
+
+    def rollover(self):
+        """
+        把内存中的数据复制到临时文件，之后的写入都写入文件
+        """
+        if self.rolled:
+            return
+        memory = self._file
+        self._file = tempfile.TemporaryFile(dir=Capture.tmp_dir())
+        self._file.write(memory.getbuffer())
+        self._file.seek(memory.tell())
+        memory.close()
+        self.rolled = True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def close(self):
+        self._file.close()
+
+
+class Capture(io.TextIOBase):
+    """
+    收集输出的缓冲区，用于命令替代等需要得到命令输出的地方。
+    输出较小时保存在内存中，超过max_size才转存到私有的临时目录。
+
+    缓冲区中保存的是字节。内部命令写入的文本编码后写入缓冲区，外部命令需要文件描述符，
+    第一次请求fileno时建立一个管道，由后台线程把管道中的字节原样读入缓冲区。
+    """
+    max_size = 1024 * 1024
+    _tmp_dir = None
+
+    def __init__(self):
+        self._buffer = _Spool(self.max_size)
+        self._lock = threading.Lock()
+        self._read_fd = None
+        self._write_fd = None
+        self._drainer = None
+
+    @classmethod
+    def tmp_dir(cls):
+        """
+        私有的临时目录，只有当前用户能够访问，shell退出时删除
+        """
+        if cls._tmp_dir is None or not os.path.isdir(cls._tmp_dir):
+            cls._tmp_dir = tempfile.mkdtemp(prefix='pysh-')
+            atexit.register(shutil.rmtree, cls._tmp_dir, True)
+        return cls._tmp_dir
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return False
+
+    def isatty(self):
+        return False
+
+    def write(self, text):
+        with self._lock:
+            # 先读入管道中已有的数据，保证输出的顺序
+            self._read_available()
+            self._buffer.write(encode(text))
+            return len(text)
+
+    def fileno(self):
+        if self._write_fd is None:
+            self._read_fd, self._write_fd = os.pipe()
+            os.set_blocking(self._read_fd, False)
+            self._drainer = threading.Thread(target=self._drain, daemon=True)
+            self._drainer.start()
+        return self._write_fd
+
+    def _read_available(self):
+        """
+        非阻塞地读入管道中已有的数据
+
+        :return: 管道是否还没有结束
+        """
+        if self._read_fd is None:
+            return False
+
+        while True:
+            try:
+                data = os.read(self._read_fd, 65536)
+            except BlockingIOError:
+                return True
+
+            if not data:
+                return False
+            self._buffer.write(data)
+
+    def _drain(self):
+        while True:
+            select.select([self._read_fd], [], [])
+            with self._lock:
+                if not self._read_available():
+                    break
+
+    def _finish(self):
+        """
+        关闭管道的写入端，等待后台线程读完剩余的数据
+        """
+        if self._write_fd is not None:
+            os.close(self._write_fd)
+            self._write_fd = None
+            self._drainer.join()
+            os.close(self._read_fd)
+            self._read_fd = None
+
+    def getvalue(self):
+        """
+        读出收集到的全部输出的原始字节
+        """
+        self._finish()
+        with self._lock:
+            self._buffer.seek(0)
+            return self._buffer.read()
+
+    def readlines(self, hint=-1):
+        """
+        读出收集到的全部输出，解码为文本的行
+        """
+        return decode(self.getvalue()).splitlines(True)
+
+    def close(self):
+        if not self.closed:
+            self._finish()
+            self._buffer.close()
+        super().close()
 
 
 class StdoutRedirection():
@@ -24,9 +353,9 @@ class StdoutRedirection():
         if file_path:
             try:
                 if file_override:
-                    self.file = open(file_path, 'wt')
+                    self.file = open_stream(file_path, 'w')
                 else:
-                    self.file = open(file_path, 'at')
+                    self.file = open_stream(file_path, 'a')
             except FileNotFoundError as e:
                 """
                 只是特别标注出来这里可能弹出的错误。
@@ -36,13 +365,8 @@ class StdoutRedirection():
             except PermissionError as e:
                 raise e
         else:
-            for num in itertools.count():
-                try:
-                    self.tmp_file = open('stdouttemp' + str(num) + '.txt', 'wt')
-                except FileExistsError:
-                    continue
-                else:
-                    break
+            # 输出收集在内存中，不再写当前目录下的临时文件
+            self.tmp_file = Capture()
 
     @contextlib.contextmanager
     def context(self):
@@ -52,12 +376,8 @@ class StdoutRedirection():
         contextlib.contextmanager装饰器自动将协程转换为上下文管理器
         yield前为进入with时执行，yield为with语句返回值，yield后退出with时执行
        """
-        origin_stdout = sys.stdout
-
-        if self.file:
-            sys.stdout = self.file
-        else:
-            sys.stdout = self.tmp_file
+        stream = self.file or self.tmp_file
+        origin_stdout = swap_stdout(stream)
 
         try:
             yield self
@@ -65,15 +385,129 @@ class StdoutRedirection():
             raise e
         finally:
             # 不论弹出什么异常，都先还原输出流
-            sys.stdout.flush()
-            sys.stdout.close()
-            sys.stdout = origin_stdout
-
+            stream.flush()
             if self.tmp_file:
-                with open(self.tmp_file.name, 'rt') as file:
-                    self.pipe = file.readlines()
+                self.pipe = self.tmp_file.readlines()
+            stream.close()
+            swap_stdout(origin_stdout)
+
+
+class Feed(io.TextIOBase):
+    """
+    把内存中的数据包装为只读的输入流，用于标记式重定向输入等数据已经在内存中的地方。
+    数据按需从source中取出，不经过磁盘。source中可以同时有文本和字节，
+    内部命令读取时字节才被解码。
+
+    外部命令需要文件描述符，第一次请求fileno时建立一个管道，由后台线程把剩余的数据写入管道，
+    字节原样写入，不经过解码再编码。
+    """
+
+    def __init__(self, source):
+        self._source = source
+        self._chunks = _flatten(source)
+        self._pending = ''
+        self._decoder = codecs.getincrementaldecoder(ENCODING)(ERRORS)
+        self._read_fd = None
+        self._reader = None
+        self._writer = None
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return False
 
-                os.remove(self.tmp_file.name)
+    def isatty(self):
+        return False
+
+    def _fill(self):
+        """
+        从source中再取出一块数据
+
+        :return: 是否还有数据
+        """
+        for chunk in self._chunks:
+            if isinstance(chunk, str):
+                # 先结束还没有解码完的字节
+                chunk = self._decoder.decode(b'', final=True) + chunk
+            else:
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                self._pending += chunk
+                return True
+
+        rest = self._decoder.decode(b'', final=True)
+        self._pending += rest
+        return bool(rest)
+
+    def readline(self, size=-1):
+        if self._reader:
+            return self._reader.readline(size)
+
+        while '\n' not in self._pending and (size < 0 or len(self._pending) < size):
+            if not self._fill():
+                break
+
+        end = self._pending.find('\n') + 1 or len(self._pending)
+        if size >= 0:
+            end = min(end, size)
+        line, self._pending = self._pending[:end], self._pending[end:]
+        return line
+
+    def read(self, size=-1):
+        if self._reader:
+            return self._reader.read(size)
+
+        while size < 0 or len(self._pending) < size:
+            if not self._fill():
+                break
+
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.readline()
+        if not line:
+            raise StopIteration
+        return line
+
+    def fileno(self):
+        if self._read_fd is None:
+            self._read_fd, write_fd = os.pipe()
+            self._writer = threading.Thread(target=self._write, args=(write_fd,), daemon=True)
+            self._writer.start()
+            # 之后内部命令也从管道中读取，避免和外部命令争抢数据
+            self._reader = open_stream(self._read_fd, 'r', closefd=False)
+        return self._read_fd
+
+    def _write(self, write_fd):
+        try:
+            with open(write_fd, 'wb') as pipe:
+                # 已经取出的数据，包括解码器中还没有解码的字节
+                pipe.write(encode(self._pending) + self._decoder.getstate()[0])
+                self._pending = ''
+                for chunk in self._chunks:
+                    pipe.write(encode(chunk) if isinstance(chunk, str) else chunk)
+        except BrokenPipeError:
+            # 读取端提前关闭了
+            pass
+
+    def close(self):
+        if not self.closed:
+            if self._read_fd is not None:
+                self._reader.close()
+                os.close(self._read_fd)
+                self._writer.join()
+            # source是生成器时，提前结束它
+            self._chunks.close()
+            if inspect.isgenerator(self._source):
+                self._source.close()
+        super().close()
 
 
 class StdinRedirection():
@@ -84,7 +518,7 @@ class StdinRedirection():
     def __init__(self, file_path=None, source=None):
         """
         如果有文件路径，将输入重定向到文件。否则将输入重定向到source。
-        source应该是一个实现了__iter__方法的可迭代对象
+        source可以是字符串、字节串，或者由它们组成的（可以嵌套的）可迭代对象
         """
         self.file = None
         self.tmp_file = None
@@ -92,43 +526,21 @@ class StdinRedirection():
 
         if file_path:
             try:
-                self.file = open(file_path, 'rt')
+                self.file = open_stream(file_path, 'r')
             except FileNotFoundError as e:
                 raise e
         else:
             self._from_source()
 
     def _from_source(self):
-        for num in itertools.count():
-            try:
-                self.tmp_file = open('stdintemp' + str(num) + '.txt', 'wt')
-            except FileExistsError:
-                continue
-            else:
-                break
-
-        self._to_temp_file(self.source)
-        self.tmp_file.close()
-        self.tmp_file = open(self.tmp_file.name, 'rt')
-        return
-
-    def _to_temp_file(self, source):
-        for line in source:
-            if type(line) != str:
-                self._to_temp_file(line)
-            else:
-                self.tmp_file.write(line)
-
+        # 直接从内存中读取，不再写入当前目录下的临时文件
+        self.tmp_file = Feed(self.source)
         return
 
     @contextlib.contextmanager
     def context(self):
-        origin_stdin = sys.stdin
-
-        if self.file:
-            sys.stdin = self.file
-        else:
-            sys.stdin = self.tmp_file
+        stream = self.file or self.tmp_file
+        origin_stdin = swap_stdin(stream)
 
         try:
             yield self
@@ -139,27 +551,150 @@ class StdinRedirection():
             raise e
         finally:
             # 还原输入流
-            sys.stdin.flush()
-            sys.stdin.close()
-            sys.stdin = origin_stdin
+            stream.close()
+            swap_stdin(origin_stdin)
 
-            if self.tmp_file:
-                os.remove(self.tmp_file.name)
+
+def _fileno(stream):
+    try:
+        return stream.fileno()
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _flatten(source):
+    """
+    依次取出source中的字符串和字节串，字节串不在这里解码
+    """
+    if isinstance(source, str):
+        yield source
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield bytes(source)
+    elif source is not None:
+        for item in source:
+            yield from _flatten(item)
+
+
+def _list_dir(path):
+    """
+    :return: (有序的名字列表, 子目录名集合)
+    """
+    names = []
+    dirs = set()
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():
+                        dirs.add(entry.name)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    names.sort()
+    return names, dirs
 
 
 class Completer:
+    # readline按state依次取候选，只在state为0时查找一次
+    _matches = []
+
+    @classmethod
+    def complete(cls, text):
+        """
+        一次得到所有补全的候选
+
+        :param text: 已经输入的文字
+        :return: 候选列表
+        """
+        return Symbols.complete(text)
+
     @classmethod
     def search_symbol(cls, text, state):
         """
         用于行编辑，编辑tab键自动补全功能。
         """
-        names = [name for name in chain(
-            History.history,
-            Application.app,
-            Variable.variable,
-            EnvVariable.variable
-        ) if name.startswith(text)]
+        if state == 0:
+            cls._matches = cls.complete(text)
         try:
-            return names[state]
+            return cls._matches[state]
         except IndexError:
-            return False
+            return None
+
+    @classmethod
+    def complete_path(cls, word, only_dirs=False):
+        """
+        补全文件路径。目录的内容由Listing缓存，目录没有修改时不会重新读取
+
+        :param word: 已经输入的路径，可以以~开头
+        :param only_dirs: 是否只补全目录
+        :return: 补全后的路径列表，目录以/结尾
+        """
+        head, prefix = os.path.split(word)
+        names, dirs = Listing.get(os.path.expanduser(head) or os.curdir)
+
+        start = bisect_left(names, prefix)
+        end = bisect_left(names, prefix + chr(0x10ffff), start)
+        results = []
+        for name in names[start:end]:
+            if name.startswith('.') and not prefix.startswith('.'):
+                # 和ls一样，隐藏文件只在明确输入.时补全
+                continue
+            if name in dirs:
+                results.append(os.path.join(head, name) + os.sep)
+            elif not only_dirs:
+                results.append(os.path.join(head, name))
+        return results
+
+
+class Listing:
+    """
+    补全路径时缓存的目录内容。
+
+    每次使用前检查目录的修改时间，没有变化时直接使用缓存，很大的目录反复补全也只读取一次。
+    最多缓存maxsize个目录，淘汰最久没有使用的目录。
+    """
+    maxsize = 64
+    # 目录的绝对路径到(修改时间, 有序的名字列表, 子目录名集合)的字典
+    storage = OrderedDict()
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls, dir):
+        """
+        :param dir: 目录
+        :return: (有序的名字列表, 子目录名集合)，目录无法读取时为空
+        """
+        path = os.path.abspath(dir)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return [], set()
+
+        with cls._lock:
+            entry = cls.storage.get(path)
+            if entry is not None and entry[0] == mtime:
+                cls.storage.move_to_end(path)
+                return entry[1], entry[2]
+
+        names, dirs = _list_dir(path)
+        with cls._lock:
+            cls.storage[path] = (mtime, names, dirs)
+            cls.storage.move_to_end(path)
+            while len(cls.storage) > cls.maxsize:
+                cls.storage.popitem(last=False)
+        return names, dirs
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls.storage.clear()
+
+
+# 替换标准输入输出为按线程区分的代理
+if not isinstance(sys.stdin, LocalStream):
+    sys.stdin = LocalStream(sys.stdin)
+
+if not isinstance(sys.stdout, LocalStream):
+    sys.stdout = LocalStream(sys.stdout)
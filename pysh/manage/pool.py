@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+"""
+预先启动的工作进程池，执行需要独立进程的后台命令。
+
+工作进程由forkserver启动，启动前已经导入了pysh的全部命令和解析器，之后反复使用。
+每个工作进程对应shell中的一个线程，线程从队列中取出后台命令，通过unix socket连同
+输入输出的文件描述符一起发给工作进程，再等待返回值。线程数就是同时执行的命令数的上限，
+超出的命令在队列中等待。
+"""
+import multiprocessing
+import os
+import pickle
+import queue
+import signal
+import socket
+import struct
+import sys
+import threading
+from concurrent.futures import Future
+
+from .env import Application, Processing, History, Variable, EnvVariable
+from .middleware import LocalStream, stdio_fds, open_stream
+from .usage import Meter
+
+# 消息头，记录消息体的长度
+_header = struct.Struct('!Q')
+
+
+class Job(Future):
+    """
+    提交到进程池的后台命令，可以像Future一样等待结果，也可以终止
+    """
+
+    def __init__(self, name, args):
+        super().__init__()
+        self.name = name
+        self.args = args
+        self.worker = None
+        # 工作进程统计的usage.Usage
+        self.usage = None
+
+    def terminate(self):
+        """
+        还没有开始执行时取消，已经在执行时结束它所在的工作进程
+        """
+        if self.cancel() or self.done():
+            return
+
+        worker = self.worker
+        if worker is not None:
+            worker.terminate()
+
+
+class Worker:
+    """
+    一个工作进程，以及shell中与它通信的socket
+    """
+
+    def __init__(self, context):
+        self.sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.process = context.Process(target=_serve, args=(child_sock,), daemon=True)
+        self.process.start()
+        child_sock.close()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def run(self, job, fds):
+        """
+        把命令发给工作进程，等待它执行完毕
+
+        :return: 命令的返回值
+        """
+        _send(self.sock, (job.name, job.args, _snapshot()), fds)
+        (rv, job.usage), _ = _recv(self.sock)
+        return rv
+
+    def terminate(self):
+        if self.is_alive():
+            os.kill(self.pid, signal.SIGTERM)
+
+    def close(self):
+        self.sock.close()
+        self.terminate()
+        self.process.join(1)
+
+
+class WorkerPool:
+    """
+    工作进程池
+    """
+    # 同时执行的后台命令数的上限，也就是工作进程数的上限
+    max_jobs = 4
+    # 启动时预先准备的工作进程数
+    prefork = 1
+    # 工作进程预先导入的模块
+    preload = ['pysh']
+
+    _queue = None
+    _threads = []
+    _workers = {}
+    _lock = threading.Lock()
+    _context = None
+
+    @classmethod
+    def context(cls):
+        if cls._context is None:
+            methods = multiprocessing.get_all_start_methods()
+            if 'forkserver' in methods:
+                cls._context = multiprocessing.get_context('forkserver')
+                cls._context.set_forkserver_preload(cls.preload)
+            else:
+                cls._context = multiprocessing.get_context()
+        return cls._context
+
+    @classmethod
+    def start(cls):
+        """
+        启动调度线程，并预先启动prefork个工作进程
+        """
+        with cls._lock:
+            if cls._queue is None:
+                cls._queue = queue.Queue()
+            while len(cls._threads) < cls.max_jobs:
+                index = len(cls._threads)
+                if index < cls.prefork:
+                    cls._workers[index] = Worker(cls.context())
+                thread = threading.Thread(target=cls._loop, args=(index,),
+                                          name='pysh-worker-{}'.format(index), daemon=True)
+                cls._threads.append(thread)
+                thread.start()
+
+    @classmethod
+    def submit(cls, task):
+        """
+        提交一个后台命令
+
+        :param task: dispatch.Task实例
+        :return: Job
+        """
+        cls.start()
+        job = Job(task.app.__name__, task.args)
+        # 输入输出在提交时复制，命令开始执行时前台的重定向可能已经结束
+        fds = [os.dup(fd) for fd in _stdio()]
+        cls._queue.put((job, fds))
+        return job
+
+    @classmethod
+    def new_max_jobs(cls, value):
+        """
+        修改同时执行的后台命令数的上限。减少时，多出的工作进程在完成当前命令后退出
+        """
+        value = int(value)
+        if value < 1:
+            raise ValueError('上限至少为1')
+
+        with cls._lock:
+            cls.max_jobs = value
+        if cls._queue is not None:
+            cls.start()
+
+    @classmethod
+    def info(cls):
+        with cls._lock:
+            return {
+                'max_jobs': cls.max_jobs,
+                'workers': len(cls._workers),
+                'pending': cls._queue.qsize() if cls._queue else 0,
+            }
+
+    @classmethod
+    def _loop(cls, index):
+        """
+        调度线程，依次把队列中的命令交给自己的工作进程
+        """
+        while True:
+            with cls._lock:
+                if index >= cls.max_jobs:
+                    # 上限减少了，结束这个线程
+                    worker = cls._workers.pop(index, None)
+                    cls._threads.remove(threading.current_thread())
+                    break
+
+            job, fds = cls._queue.get()
+            try:
+                if not job.set_running_or_notify_cancel():
+                    continue
+
+                worker = cls._workers.get(index)
+                try:
+                    if worker is None or not worker.is_alive():
+                        worker = cls._workers[index] = Worker(cls.context())
+                    job.worker = worker
+                    rv = worker.run(job, fds)
+                except (EOFError, OSError):
+                    # 工作进程被终止了，下次使用时重新启动
+                    cls._drop(index)
+                    rv = False
+                except Exception as e:
+                    # 比如参数无法pickle。消息可能只发送了一部分，这个工作进程不能再使用，
+                    # 异常交给等待结果的一方，调度线程继续处理之后的命令
+                    cls._drop(index)
+                    job.set_exception(e)
+                    continue
+                job.set_result(rv)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+
+        if worker is not None:
+            worker.close()
+
+    @classmethod
+    def _drop(cls, index):
+        """
+        关闭并移除第index个工作进程，下次使用时重新启动
+        """
+        worker = cls._workers.pop(index, None)
+        if worker is not None:
+            worker.close()
+
+
+# 以下为辅助函数
+
+
+def _stdio():
+    stdin, stdout = stdio_fds()
+    sys.stderr.flush()
+    return [0 if stdin is None else stdin, 1 if stdout is None else stdout, sys.stderr.fileno()]
+
+
+def _snapshot():
+    """
+    命令执行时需要的shell状态
+    """
+    return {
+        'cwd': os.getcwd(),
+        'environ': dict(os.environ),
+        'variable': Variable.variable,
+        'env_variable': EnvVariable.variable,
+        'history': History.history,
+    }
+
+
+def _restore(state):
+    os.chdir(state['cwd'])
+    os.environ.clear()
+    os.environ.update(state['environ'])
+    Variable.variable = state['variable']
+    EnvVariable.variable = state['env_variable']
+    EnvVariable.invalidate()
+    History.history = state['history']
+
+
+def _send(sock, message, fds=()):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    # 文件描述符随消息头一起发送
+    socket.send_fds(sock, [_header.pack(len(data))], list(fds))
+    sock.sendall(data)
+
+
+def _recv(sock):
+    header, fds, _, _ = socket.recv_fds(sock, _header.size, 3)
+    if not header:
+        raise EOFError('工作进程已经退出')
+    while len(header) < _header.size:
+        chunk = sock.recv(_header.size - len(header))
+        if not chunk:
+            raise EOFError('工作进程已经退出')
+        header += chunk
+
+    size, = _header.unpack(header)
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 65536))
+        if not chunk:
+            raise EOFError('工作进程已经退出')
+        data += chunk
+
+    return pickle.loads(data), fds
+
+
+def _serve(sock):
+    """
+    工作进程的主循环
+    """
+    from .dispatch import Task
+
+    # 与shell一样，中断信号由前台命令处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            (name, args, state), fds = _recv(sock)
+        except EOFError:
+            break
+
+        rv = False
+        # 命令在工作进程中启动的外部命令也计算在内
+        meter = Meter(children=True)
+        try:
+            _restore(state)
+            # 收到的文件描述符作为这个命令的标准输入输出
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            sys.stdin = LocalStream(open_stream(0, 'r', closefd=False))
+            sys.stdout = LocalStream(open_stream(1, 'w', closefd=False))
+
+            task = Task(Application.app[name], *args)
+            task.backend = True
+            rv = task.run()
+        except SystemExit:
+            pass
+        except Exception as e:
+            print(e)
+        finally:
+            try:
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass
+            Processing.reset()
+            # 不再占用命令的输入输出，否则管道的读取端读不到文件结尾
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for target in range(3):
+                os.dup2(devnull, target)
+            os.close(devnull)
+
+        try:
+            pickle.dumps(rv)
+        except Exception:
+            rv = bool(rv)
+        _send(sock, (rv, meter.stop()))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+命令的资源使用统计：墙上时间、用户态和内核态CPU时间、最大常驻内存。
+
+外部命令的数据来自回收子进程时wait4返回的rusage；内部命令在自己的线程中执行，
+统计这个线程的rusage的差值。内部命令与shell共用一个进程，无法得到自己的最大内存。
+没有resource模块的平台上只统计墙上时间。
+"""
+import sys
+import threading
+import time
+from collections import namedtuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 时间单位为秒，maxrss单位为KB，无法统计的项为None
+Usage = namedtuple('Usage', ['wall', 'user', 'sys', 'maxrss'])
+
+# 每个线程当前统计子进程的Meter。外部命令在创建时记下所在线程的Meter，回收时只报告给它，
+# 其它线程中的后台命令、管道和parallel启动的子进程不会计入
+_local = threading.local()
+
+# 按线程统计只有linux支持，其它平台统计整个进程
+_scope = getattr(resource, 'RUSAGE_THREAD', getattr(resource, 'RUSAGE_SELF', None))
+
+
+class Meter:
+    """
+    统计从创建到stop之间的资源使用
+    """
+
+    def __init__(self, cpu=True, children=False):
+        """
+        :param cpu: 是否统计当前线程的CPU时间。生成器在多个线程中恢复执行时无法统计
+        :param children: 是否加上这期间当前线程启动的子进程的资源使用，供time命令使用
+        """
+        self.start = time.monotonic()
+        self._self = _getrusage(_scope) if cpu else None
+        self.children = children
+        # 报告给这个Meter的子进程的CPU时间之和与最大内存
+        self._child_user = self._child_sys = None
+        self._child_maxrss = None
+        self._lock = threading.Lock()
+        self._previous = None
+        if children:
+            # 嵌套的time结束后恢复外层的Meter
+            self._previous = current()
+            _local.meter = self
+
+    def report(self, usage):
+        """
+        回收子进程时调用，把子进程的资源使用计入这个Meter。
+        子进程可能由信号处理函数在其它线程中回收，所以需要加锁
+
+        :param usage: 由wait4的rusage得到的Usage
+        """
+        if usage is None:
+            return
+        with self._lock:
+            if usage.user is not None:
+                self._child_user = (self._child_user or 0) + usage.user
+                self._child_sys = (self._child_sys or 0) + usage.sys
+            if usage.maxrss is not None and (self._child_maxrss is None
+                                             or usage.maxrss > self._child_maxrss):
+                self._child_maxrss = usage.maxrss
+
+    def stop(self):
+        """
+        :return: Usage
+        """
+        wall = time.monotonic() - self.start
+        user = sys_time = None
+        if self.children and current() is self:
+            _local.meter = self._previous
+
+        if self._self is not None:
+            end = _getrusage(_scope)
+            user = end.ru_utime - self._self.ru_utime
+            sys_time = end.ru_stime - self._self.ru_stime
+
+        with self._lock:
+            if self._child_user is not None:
+                user = (user or 0) + self._child_user
+                sys_time = (sys_time or 0) + self._child_sys
+            # 只有子进程的最大内存，没有子进程时无法统计
+            maxrss = self._child_maxrss
+
+        return Usage(wall, user, sys_time, maxrss)
+
+
+def current():
+    """
+    :return: 当前线程中统计子进程的Meter，没有时为None
+    """
+    return getattr(_local, 'meter', None)
+
+
+def from_rusage(wall, rusage):
+    """
+    把wait4返回的rusage转换为Usage
+    """
+    if rusage is None:
+        return Usage(wall, None, None, None)
+    return Usage(wall, rusage.ru_utime, rusage.ru_stime, _kilobytes(rusage.ru_maxrss))
+
+
+def format_seconds(value):
+    return '-' if value is None else '{:.3f}'.format(value)
+
+
+def format_kilobytes(value):
+    return '-' if value is None else str(value)
+
+
+# 以下为辅助函数
+
+def _getrusage(scope):
+    if resource is None or scope is None:
+        return None
+    return resource.getrusage(scope)
+
+
+def _kilobytes(maxrss):
+    # macOS的ru_maxrss单位是字节
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss